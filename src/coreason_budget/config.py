@@ -10,11 +10,14 @@ class CoreasonBudgetConfig(BaseSettings):  # type: ignore
     """
 
     redis_url: str = Field(..., description="The Redis connection URL.")
+    redis_max_connections: int = Field(
+        default=32, description="Maximum connections per Redis connection pool; further commands wait for a free one."
+    )
 
     # Limits
-    daily_global_limit_usd: float = Field(5000.0, description="Global daily hard limit in USD.")
-    daily_project_limit_usd: float = Field(500.0, description="Default daily limit per project in USD.")
-    daily_user_limit_usd: float = Field(10.0, description="Default daily limit per user in USD.")
+    daily_global_limit_usd: float = Field(default=5000.0, description="Global daily hard limit in USD.")
+    daily_project_limit_usd: float = Field(default=500.0, description="Default daily limit per project in USD.")
+    daily_user_limit_usd: float = Field(default=10.0, description="Default daily limit per user in USD.")
 
     # Overrides
     model_price_overrides: Dict[str, Dict[str, float]] = Field(
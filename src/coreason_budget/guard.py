@@ -1,5 +1,5 @@
-from datetime import datetime, timezone
-from typing import Optional
+import time
+from typing import NamedTuple, Optional, Sequence
 
 from coreason_identity.models import UserContext
 
@@ -8,16 +8,37 @@ from coreason_budget.exceptions import BudgetExceededError
 from coreason_budget.ledger import RedisLedger, SyncRedisLedger
 from coreason_budget.utils.logger import logger
 
+SECONDS_PER_DAY = 86400
+
+# Scopes are compared in this order; the first one over its limit is the one reported
+CHECK_ORDER = ("global", "project", "user")
+
+
+class Spend(NamedTuple):
+    """A single spend to record, as passed to BudgetGuard.charge_many."""
+
+    user_context: UserContext
+    cost: float
+    project_id: Optional[str] = None
+    model: Optional[str] = None
+
 
 class BaseBudgetGuard:
     """Base logic for BudgetGuard (Sync and Async)."""
 
     def __init__(self, config: CoreasonBudgetConfig):
         self.config = config
+        self._date_cache = (-1, "")
 
     def _get_date_str(self) -> str:
-        """Get current date string (UTC) for key construction."""
-        return datetime.now(timezone.utc).strftime("%Y-%m-%d")
+        """
+        Get current date string (UTC) for key construction.
+        Formatted once per UTC day; other calls only compare the day number.
+        """
+        day = int(time.time()) // SECONDS_PER_DAY
+        if self._date_cache[0] != day:
+            self._date_cache = (day, time.strftime("%Y-%m-%d", time.gmtime(day * SECONDS_PER_DAY)))
+        return self._date_cache[1]
 
     def _get_keys(self, user_id: str, project_id: Optional[str] = None) -> dict[str, str]:
         """Construct Redis keys for different scopes."""
@@ -35,11 +56,57 @@ class BaseBudgetGuard:
         Calculate seconds until next UTC midnight.
         This ensures keys expire automatically.
         """
-        now = datetime.now(timezone.utc)
-        # Midnight next day
-        midnight = now.replace(hour=0, minute=0, second=0, microsecond=0).timestamp() + 86400
-        current = now.timestamp()
-        return int(midnight - current)
+        return SECONDS_PER_DAY - int(time.time()) % SECONDS_PER_DAY
+
+    def _exceeded(
+        self, scope: str, used: float, limit: float, user_id: str, project_id: Optional[str]
+    ) -> BudgetExceededError:
+        """Log a breached scope and build the error to raise for it."""
+        if scope == "global":
+            logger.warning("Global budget exceeded. Used: ${}, Limit: ${}", used, limit)
+            return BudgetExceededError("Global daily limit exceeded")
+        if scope == "project":
+            logger.warning("Project budget exceeded. Project: {}, Used: ${}, Limit: ${}", project_id, used, limit)
+            return BudgetExceededError(f"Project daily limit exceeded for {project_id}")
+        logger.warning("User budget exceeded. User: {}, Used: ${}, Limit: ${}", user_id, used, limit)
+        return BudgetExceededError(f"User daily limit exceeded for {user_id}")
+
+    def _scope_limits(self, keys: dict[str, str]) -> list[tuple[str, str, float]]:
+        """(scope, key, limit) for every scope in keys, in check order: global, project, user."""
+        config = self.config
+        limits = {
+            "global": config.daily_global_limit_usd,
+            "project": config.daily_project_limit_usd,
+            "user": config.daily_user_limit_usd,
+        }
+        return [(scope, keys[scope], limits[scope]) for scope in CHECK_ORDER if scope in keys]
+
+    def _enforce(
+        self,
+        scopes: list[tuple[str, str, float]],
+        usage: Sequence[float],
+        estimated_cost: float,
+        user_id: str,
+        project_id: Optional[str],
+    ) -> None:
+        """Raise for the first scope whose usage plus estimated_cost would pass its limit."""
+        for (scope, _, limit), used in zip(scopes, usage, strict=True):
+            if used + estimated_cost > limit:
+                raise self._exceeded(scope, used, limit, user_id, project_id)
+
+    def _log_spend(self, user_id: str, cost: float, project_id: Optional[str], model: Optional[str]) -> None:
+        """Emit the FinOps observability records for one recorded spend."""
+        logger.info(
+            "Transaction Recorded",
+            extra={
+                "event": "finops.spend.total",
+                "user_id": user_id,
+                "project_id": project_id,
+                "model": model,
+                "cost_usd": cost,
+            },
+        )
+        logger.info("Recorded Spend: User {} | Cost: ${} | Project: {} | Model: {}", user_id, cost, project_id, model)
 
 
 class BudgetGuard(BaseBudgetGuard):
@@ -57,46 +124,19 @@ class BudgetGuard(BaseBudgetGuard):
         Raises BudgetExceededError if limit would be breached.
         """
         user_id = user_context.user_id
-        keys = self._get_keys(user_id, project_id)
-
-        # 1. Global Check
-        global_usage = await self.ledger.get_usage(keys["global"])
-        if global_usage + estimated_cost > self.config.daily_global_limit_usd:
-            logger.warning(
-                "Global budget exceeded. Used: ${}, Limit: ${}", global_usage, self.config.daily_global_limit_usd
-            )
-            raise BudgetExceededError("Global daily limit exceeded")
-
-        # 2. Project Check
-        if project_id and "project" in keys:
-            project_usage = await self.ledger.get_usage(keys["project"])
-            if project_usage + estimated_cost > self.config.daily_project_limit_usd:
-                logger.warning(
-                    "Project budget exceeded. Project: {}, Used: ${}, Limit: ${}",
-                    project_id,
-                    project_usage,
-                    self.config.daily_project_limit_usd,
-                )
-                raise BudgetExceededError(f"Project daily limit exceeded for {project_id}")
-
-        # 3. User Check
-        user_usage = await self.ledger.get_usage(keys["user"])
-        if user_usage + estimated_cost > self.config.daily_user_limit_usd:
-            logger.warning(
-                "User budget exceeded. User: {}, Used: ${}, Limit: ${}",
-                user_id,
-                user_usage,
-                self.config.daily_user_limit_usd,
-            )
-            raise BudgetExceededError(f"User daily limit exceeded for {user_id}")
-
-        # Success Log with details
-        logger.info(
+        scopes = self._scope_limits(self._get_keys(user_id, project_id))
+
+        # Every scope is read in one round-trip, then compared in check order
+        usage = await self.ledger.get_usage_many([key for _, key, _ in scopes])
+        self._enforce(scopes, usage, estimated_cost, user_id, project_id)
+
+        # Success Log with details; DEBUG because it fires on every check
+        logger.debug(
             "Budget Check Passed: User {} | Estimated Cost: ${} | Global Used: ${} | User Used: ${}",
             user_id,
             estimated_cost,
-            global_usage,
-            user_usage,
+            usage[0],
+            usage[-1],
         )
         return True
 
@@ -107,25 +147,50 @@ class BudgetGuard(BaseBudgetGuard):
         Record actual spend.
         Updates counters for all scopes.
         """
-        user_id = user_context.user_id
-        keys = self._get_keys(user_id, project_id)
-        ttl = self._calculate_ttl()
+        await self.charge_many([Spend(user_context, cost, project_id, model)])
 
-        for key in keys.values():
-            await self.ledger.increment(key, cost, owner_id=user_id, ttl=ttl)
+    async def charge_many(self, spends: Sequence[Spend]) -> None:
+        """
+        Record several spends at once.
+        Costs landing on the same scope key are summed, then every key is written in one round-trip.
+        Zero-cost spends are logged but add nothing, so they never reach Redis.
+        """
+        amounts: dict[str, float] = {}
+        owners: dict[str, None] = {}
+        for spend in spends:
+            if spend.cost == 0.0:
+                continue
+            owners[spend.user_context.user_id] = None
+            for key in self._get_keys(spend.user_context.user_id, spend.project_id).values():
+                amounts[key] = amounts.get(key, 0.0) + spend.cost
+
+        if amounts:
+            await self.ledger.increment_many(amounts, owner_id=",".join(owners), ttl=self._calculate_ttl())
 
         # Observability
-        logger.info(
-            "Transaction Recorded",
-            extra={
-                "event": "finops.spend.total",
-                "user_id": user_id,
-                "project_id": project_id,
-                "model": model,
-                "cost_usd": cost,
-            },
+        for spend in spends:
+            self._log_spend(spend.user_context.user_id, spend.cost, spend.project_id, spend.model)
+
+    async def check_and_charge(
+        self, user_context: UserContext, cost: float, project_id: Optional[str] = None, model: Optional[str] = None
+    ) -> None:
+        """
+        Check every scope against cost and record it, as one atomic step.
+        Raises BudgetExceededError, without recording anything, if any limit would be breached.
+        """
+        user_id = user_context.user_id
+        scopes = self._scope_limits(self._get_keys(user_id, project_id))
+
+        exceeded = await self.ledger.increment_within_limits(
+            {key: limit for _, key, limit in scopes}, cost, owner_id=user_id, ttl=self._calculate_ttl()
         )
-        logger.info("Recorded Spend: User {} | Cost: ${} | Project: {} | Model: {}", user_id, cost, project_id, model)
+        if exceeded is not None:
+            # Nothing was written; report the breached scope exactly as check() would
+            breached, used = exceeded
+            scope, _, limit = next(row for row in scopes if row[1] == breached)
+            raise self._exceeded(scope, used, limit, user_id, project_id)
+
+        self._log_spend(user_id, cost, project_id, model)
 
 
 class SyncBudgetGuard(BaseBudgetGuard):
@@ -137,42 +202,18 @@ class SyncBudgetGuard(BaseBudgetGuard):
 
     def check(self, user_context: UserContext, project_id: Optional[str] = None, estimated_cost: float = 0.0) -> bool:
         user_id = user_context.user_id
-        keys = self._get_keys(user_id, project_id)
-
-        global_usage = self.ledger.get_usage(keys["global"])
-        if global_usage + estimated_cost > self.config.daily_global_limit_usd:
-            logger.warning(
-                "Global budget exceeded. Used: ${}, Limit: ${}", global_usage, self.config.daily_global_limit_usd
-            )
-            raise BudgetExceededError("Global daily limit exceeded")
-
-        if project_id and "project" in keys:
-            project_usage = self.ledger.get_usage(keys["project"])
-            if project_usage + estimated_cost > self.config.daily_project_limit_usd:
-                logger.warning(
-                    "Project budget exceeded. Project: {}, Used: ${}, Limit: ${}",
-                    project_id,
-                    project_usage,
-                    self.config.daily_project_limit_usd,
-                )
-                raise BudgetExceededError(f"Project daily limit exceeded for {project_id}")
-
-        user_usage = self.ledger.get_usage(keys["user"])
-        if user_usage + estimated_cost > self.config.daily_user_limit_usd:
-            logger.warning(
-                "User budget exceeded. User: {}, Used: ${}, Limit: ${}",
-                user_id,
-                user_usage,
-                self.config.daily_user_limit_usd,
-            )
-            raise BudgetExceededError(f"User daily limit exceeded for {user_id}")
+        scopes = self._scope_limits(self._get_keys(user_id, project_id))
 
-        logger.info(
+        # Every scope is read in one round-trip, then compared in check order
+        usage = self.ledger.get_usage_many([key for _, key, _ in scopes])
+        self._enforce(scopes, usage, estimated_cost, user_id, project_id)
+
+        logger.debug(
             "Budget Check Passed: User {} | Estimated Cost: ${} | Global Used: ${} | User Used: ${}",
             user_id,
             estimated_cost,
-            global_usage,
-            user_usage,
+            usage[0],
+            usage[-1],
         )
         return True
 
@@ -180,20 +221,32 @@ class SyncBudgetGuard(BaseBudgetGuard):
         self, user_context: UserContext, cost: float, project_id: Optional[str] = None, model: Optional[str] = None
     ) -> None:
         user_id = user_context.user_id
-        keys = self._get_keys(user_id, project_id)
-        ttl = self._calculate_ttl()
+        if cost != 0.0:
+            # A zero spend adds nothing, so only the log is emitted
+            keys = self._get_keys(user_id, project_id)
+            ttl = self._calculate_ttl()
 
-        for key in keys.values():
-            self.ledger.increment(key, cost, owner_id=user_id, ttl=ttl)
+            self.ledger.increment_many(dict.fromkeys(keys.values(), cost), owner_id=user_id, ttl=ttl)
 
-        logger.info(
-            "Transaction Recorded",
-            extra={
-                "event": "finops.spend.total",
-                "user_id": user_id,
-                "project_id": project_id,
-                "model": model,
-                "cost_usd": cost,
-            },
+        self._log_spend(user_id, cost, project_id, model)
+
+    def check_and_charge(
+        self, user_context: UserContext, cost: float, project_id: Optional[str] = None, model: Optional[str] = None
+    ) -> None:
+        """
+        Check every scope against cost and record it, as one atomic step.
+        Raises BudgetExceededError, without recording anything, if any limit would be breached.
+        """
+        user_id = user_context.user_id
+        scopes = self._scope_limits(self._get_keys(user_id, project_id))
+
+        exceeded = self.ledger.increment_within_limits(
+            {key: limit for _, key, limit in scopes}, cost, owner_id=user_id, ttl=self._calculate_ttl()
         )
-        logger.info("Recorded Spend: User {} | Cost: ${} | Project: {} | Model: {}", user_id, cost, project_id, model)
+        if exceeded is not None:
+            # Nothing was written; report the breached scope exactly as check() would
+            breached, used = exceeded
+            scope, _, limit = next(row for row in scopes if row[1] == breached)
+            raise self._exceeded(scope, used, limit, user_id, project_id)
+
+        self._log_spend(user_id, cost, project_id, model)
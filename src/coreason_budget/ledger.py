@@ -8,12 +8,15 @@
 #
 # Source Code: https://github.com/CoReason-AI/coreason_budget
 
-from typing import Optional
+import hashlib
+import socket
+import threading
+from typing import Any, Dict, List, Optional, Tuple
 
+from redis import BlockingConnectionPool as SyncBlockingConnectionPool
 from redis import Redis as SyncRedis
-from redis import from_url as sync_from_url
-from redis.asyncio import Redis, from_url
-from redis.exceptions import RedisError
+from redis.asyncio import BlockingConnectionPool, Redis
+from redis.exceptions import NoScriptError, RedisError
 
 from coreason_budget.exceptions import RedisConnectionError
 from coreason_budget.utils.logger import logger
@@ -30,21 +33,190 @@ end
 return current
 """
 
+# KEYS[1..N] are incremented by ARGV[1..N]; ARGV[N+1] is the TTL, applied as in LUA_INCREMENT_SCRIPT.
+# Redis does not roll back a script that fails halfway, so every key is checked before any is written:
+# either all of the keys move or none do.
+LUA_INCREMENT_MANY_SCRIPT = """
+for i = 1, #KEYS do
+    local current = redis.call("GET", KEYS[i])
+    if current and not tonumber(current) then
+        return redis.error_reply("ERR value is not a valid float: " .. KEYS[i])
+    end
+end
+local ttl = ARGV[#KEYS + 1]
+local results = {}
+for i = 1, #KEYS do
+    results[i] = redis.call("INCRBYFLOAT", KEYS[i], ARGV[i])
+    if ttl ~= "nil" and redis.call("TTL", KEYS[i]) == -1 then
+        redis.call("EXPIRE", KEYS[i], ttl)
+    end
+end
+return results
+"""
+
+# Check-and-charge in one atomic step. KEYS[1..N] are checked in order against the limits in
+# ARGV[3..N+2]; the first key whose usage plus ARGV[1] would pass its limit is reported as
+# {index, usage} and nothing is written. Otherwise every key is incremented by ARGV[1], with
+# ARGV[2] as the TTL, and {0} is returned.
+LUA_INCREMENT_WITHIN_LIMITS_SCRIPT = """
+local amount = tonumber(ARGV[1])
+for i = 1, #KEYS do
+    local current = redis.call("GET", KEYS[i])
+    local used = 0
+    if current then
+        used = tonumber(current)
+        if not used then
+            return redis.error_reply("ERR value is not a valid float: " .. KEYS[i])
+        end
+    end
+    if used + amount > tonumber(ARGV[i + 2]) then
+        return {i, current or "0"}
+    end
+end
+for i = 1, #KEYS do
+    redis.call("INCRBYFLOAT", KEYS[i], ARGV[1])
+    if ARGV[2] ~= "nil" and redis.call("TTL", KEYS[i]) == -1 then
+        redis.call("EXPIRE", KEYS[i], ARGV[2])
+    end
+end
+return {0}
+"""
+
+LUA_SCRIPTS = (LUA_INCREMENT_SCRIPT, LUA_INCREMENT_MANY_SCRIPT, LUA_INCREMENT_WITHIN_LIMITS_SCRIPT)
+
+# Increments call EVALSHA with these digests instead of shipping the script body each time
+LUA_INCREMENT_SHA = hashlib.sha1(LUA_INCREMENT_SCRIPT.encode("utf-8")).hexdigest()
+LUA_INCREMENT_MANY_SHA = hashlib.sha1(LUA_INCREMENT_MANY_SCRIPT.encode("utf-8")).hexdigest()
+LUA_INCREMENT_WITHIN_LIMITS_SHA = hashlib.sha1(LUA_INCREMENT_WITHIN_LIMITS_SCRIPT.encode("utf-8")).hexdigest()
+
+
+DEFAULT_MAX_CONNECTIONS = 32
+# Once every pooled connection is busy, a command waits this long for one to be released before failing
+POOL_TIMEOUT_SECONDS = 10.0
+
+
+def _connection_kwargs(max_connections: int) -> Dict[str, Any]:
+    """
+    Pool and socket options shared by the async and sync clients.
+    Pools are blocking: past max_connections, commands queue for a connection instead of erroring.
+    Keepalive probes stop idle pooled connections from being silently dropped;
+    options missing on the current platform are skipped.
+    """
+    keepalive_options = {
+        getattr(socket, name): value
+        for name, value in (("TCP_KEEPIDLE", 30), ("TCP_KEEPINTVL", 10), ("TCP_KEEPCNT", 3))
+        if hasattr(socket, name)
+    }
+    return {
+        "max_connections": max_connections,
+        "timeout": POOL_TIMEOUT_SECONDS,
+        "socket_keepalive": True,
+        "socket_keepalive_options": keepalive_options,
+        "health_check_interval": 30,
+    }
+
+
+# Shared sync pools, one per (url, max_connections), with the number of open ledgers using each;
+# see _acquire_sync_pool. The lock keeps the counts right when ledgers open and close on several threads.
+_SYNC_POOLS: Dict[Tuple[str, int], Tuple[SyncBlockingConnectionPool, int]] = {}
+_SYNC_POOLS_LOCK = threading.Lock()
+
+
+def _async_client(redis_url: str, max_connections: int) -> Redis:
+    """Async client that owns its own blocking pool, closed along with the client."""
+    return Redis.from_pool(
+        BlockingConnectionPool.from_url(redis_url, encoding="utf-8", **_connection_kwargs(max_connections))
+    )
+
+
+def _acquire_sync_pool(redis_url: str, max_connections: int) -> SyncBlockingConnectionPool:
+    """
+    Return the process-wide sync pool for this URL and size, creating it on first use.
+    Every SyncRedisLedger draws from it, so new managers reuse warm connections instead of
+    dialing (and authenticating) their own. Each call must be paired with _release_sync_pool.
+    Async pools are not shared this way: their connections belong to the event loop that opened them.
+    """
+    key = (redis_url, max_connections)
+    with _SYNC_POOLS_LOCK:
+        pool, users = _SYNC_POOLS.get(key, (None, 0))
+        if pool is None:
+            pool = SyncBlockingConnectionPool.from_url(
+                redis_url, encoding="utf-8", **_connection_kwargs(max_connections)
+            )
+        _SYNC_POOLS[key] = (pool, users + 1)
+    return pool
+
+
+def _release_sync_pool(redis_url: str, max_connections: int, pool: SyncBlockingConnectionPool) -> None:
+    """Drop one use of a shared sync pool, disconnecting it once no ledger uses it any more."""
+    key = (redis_url, max_connections)
+    with _SYNC_POOLS_LOCK:
+        shared, users = _SYNC_POOLS.get(key, (None, 0))
+        if shared is not pool:
+            # Already torn down by disconnect_sync_pools; a newer pool may have taken its place
+            return
+        if users > 1:
+            _SYNC_POOLS[key] = (pool, users - 1)
+            return
+        del _SYNC_POOLS[key]
+    pool.disconnect()
+
+
+def disconnect_sync_pools() -> None:
+    """
+    Disconnect and forget every shared sync pool, including ones that open ledgers still use.
+    Closing each SyncRedisLedger is the normal way to release them; this is for test teardown.
+    """
+    with _SYNC_POOLS_LOCK:
+        pools = [pool for pool, _ in _SYNC_POOLS.values()]
+        _SYNC_POOLS.clear()
+    for pool in pools:
+        pool.disconnect()
+
+
+def _increment_args(amount: float, ttl: Optional[int]) -> tuple[str, str]:
+    """Script arguments for LUA_INCREMENT_SCRIPT; "nil" leaves the TTL untouched."""
+    return str(amount), str(ttl) if ttl is not None else "nil"
+
+
+def _increment_many_args(amounts: Dict[str, float], ttl: Optional[int]) -> List[Any]:
+    """numkeys, KEYS and ARGV for LUA_INCREMENT_MANY_SCRIPT."""
+    return [
+        len(amounts),
+        *amounts,
+        *(str(amount) for amount in amounts.values()),
+        str(ttl) if ttl is not None else "nil",
+    ]
+
+
+def _increment_within_limits_args(limits: Dict[str, float], amount: float, ttl: Optional[int]) -> List[Any]:
+    """numkeys, KEYS and ARGV for LUA_INCREMENT_WITHIN_LIMITS_SCRIPT."""
+    return [
+        len(limits),
+        *limits,
+        *_increment_args(amount, ttl),
+        *(str(limit) for limit in limits.values()),
+    ]
+
 
 class RedisLedger:
     """Manages Redis connections and atomic operations for budget tracking."""
 
-    def __init__(self, redis_url: str) -> None:
+    def __init__(self, redis_url: str, max_connections: int = DEFAULT_MAX_CONNECTIONS) -> None:
         self.redis_url = redis_url
-        self._redis: Redis = from_url(self.redis_url, encoding="utf-8", decode_responses=True)
+        # Replies stay raw bytes: every value read is numeric and float() parses bytes directly
+        self._redis: Redis = _async_client(self.redis_url, max_connections)
 
     async def connect(self) -> None:
         """
-        Verify connection to Redis.
+        Verify connection to Redis and load the Lua scripts.
         Strictly required for 'Fail Closed' startup checks.
         """
         try:
             await self._redis.ping()
+            # Loaded up front so the first spend does not pay for a NOSCRIPT miss and reload
+            for script in LUA_SCRIPTS:
+                await self._redis.script_load(script)
             logger.info("Connected to Redis at {}", self.redis_url)
         except Exception as e:
             logger.error("Failed to connect to Redis: {}", e)
@@ -64,42 +236,105 @@ class RedisLedger:
             logger.error("Redis GET error for key {}: {}", key, e)
             raise
 
+    async def get_usage_many(self, keys: List[str]) -> List[float]:
+        """Get current usage for several keys with one MGET. Missing keys read as 0.0."""
+        try:
+            values = await self._redis.mget(keys)
+            return [float(val) if val else 0.0 for val in values]
+        except RedisError as e:
+            logger.error("Redis MGET error for keys {}: {}", keys, e)
+            raise
+
     async def increment(self, key: str, amount: float, owner_id: str, ttl: Optional[int] = None) -> float:
         """
         Atomically increment a key by amount.
         Returns the new value.
         """
         try:
-            ttl_arg = str(ttl) if ttl is not None else "nil"
-            result = await self._redis.eval(LUA_INCREMENT_SCRIPT, 1, key, str(amount), ttl_arg)
+            result = await self._run_script(
+                LUA_INCREMENT_SCRIPT, LUA_INCREMENT_SHA, 1, key, *_increment_args(amount, ttl)
+            )
             return float(result)
         except RedisError as e:
             logger.error("Redis INCRBYFLOAT error for key {} (owner: {}): {}", key, owner_id, e)
             raise
 
+    async def increment_many(self, amounts: Dict[str, float], owner_id: str, ttl: Optional[int] = None) -> List[float]:
+        """
+        Atomically increment each key by its amount in a single round-trip.
+        Either every key is incremented or none is. Returns the new values in key order.
+        """
+        try:
+            results = await self._run_script(
+                LUA_INCREMENT_MANY_SCRIPT, LUA_INCREMENT_MANY_SHA, *_increment_many_args(amounts, ttl)
+            )
+            return [float(result) for result in results]
+        except RedisError as e:
+            logger.error("Redis INCRBYFLOAT error for keys {} (owner: {}): {}", list(amounts), owner_id, e)
+            raise
+
+    async def increment_within_limits(
+        self, limits: Dict[str, float], amount: float, owner_id: str, ttl: Optional[int] = None
+    ) -> Optional[Tuple[str, float]]:
+        """
+        Atomically increment every key by amount, unless that would take any key past its limit.
+        Keys are checked in order. Returns (key, current usage) for the first one that would exceed,
+        in which case nothing is written, or None once every key has been incremented.
+        """
+        try:
+            result = await self._run_script(
+                LUA_INCREMENT_WITHIN_LIMITS_SCRIPT,
+                LUA_INCREMENT_WITHIN_LIMITS_SHA,
+                *_increment_within_limits_args(limits, amount, ttl),
+            )
+        except RedisError as e:
+            logger.error("Redis INCRBYFLOAT error for keys {} (owner: {}): {}", list(limits), owner_id, e)
+            raise
+        if result[0] == 0:
+            return None
+        return list(limits)[result[0] - 1], float(result[1])
+
+    async def _run_script(self, script: str, sha: str, *args: Any) -> Any:
+        """EVALSHA a script by digest, loading it first if Redis does not have it cached."""
+        try:
+            return await self._redis.evalsha(sha, *args)
+        except NoScriptError:
+            # Script cache is empty (first use or SCRIPT FLUSH): nothing ran, so load and replay
+            await self._redis.script_load(script)
+            return await self._redis.evalsha(sha, *args)
+
 
 class SyncRedisLedger:
     """Manages Synchronous Redis connections and atomic operations for budget tracking."""
 
-    def __init__(self, redis_url: str) -> None:
+    def __init__(self, redis_url: str, max_connections: int = DEFAULT_MAX_CONNECTIONS) -> None:
         self.redis_url = redis_url
-        self._redis: SyncRedis = sync_from_url(self.redis_url, encoding="utf-8", decode_responses=True)
+        self._max_connections = max_connections
+        self._pool: Optional[SyncBlockingConnectionPool] = _acquire_sync_pool(redis_url, max_connections)
+        # Replies stay raw bytes: every value read is numeric and float() parses bytes directly
+        self._redis: SyncRedis = SyncRedis(connection_pool=self._pool)
 
     def connect(self) -> None:
         """
-        Verify connection to Redis.
+        Verify connection to Redis and load the Lua scripts.
         Strictly required for 'Fail Closed' startup checks.
         """
         try:
             self._redis.ping()
+            # Loaded up front so the first spend does not pay for a NOSCRIPT miss and reload
+            for script in LUA_SCRIPTS:
+                self._redis.script_load(script)
             logger.info("Connected to Redis at {}", self.redis_url)
         except Exception as e:
             logger.error("Failed to connect to Redis: {}", e)
             raise RedisConnectionError(f"Could not connect to Redis: {e}") from e
 
     def close(self) -> None:
-        """Close the Redis connection pool."""
+        """Release this client. The shared pool is disconnected once the last ledger using it closes."""
         self._redis.close()
+        if self._pool is not None:
+            _release_sync_pool(self.redis_url, self._max_connections, self._pool)
+            self._pool = None
         logger.info("Closed Redis connection")
 
     def get_usage(self, key: str) -> float:
@@ -111,15 +346,67 @@ class SyncRedisLedger:
             logger.error("Redis GET error for key {}: {}", key, e)
             raise
 
+    def get_usage_many(self, keys: List[str]) -> List[float]:
+        """Get current usage for several keys with one MGET. Missing keys read as 0.0."""
+        try:
+            values = self._redis.mget(keys)
+            return [float(val) if val else 0.0 for val in values]
+        except RedisError as e:
+            logger.error("Redis MGET error for keys {}: {}", keys, e)
+            raise
+
     def increment(self, key: str, amount: float, owner_id: str, ttl: Optional[int] = None) -> float:
         """
         Atomically increment a key by amount.
         Returns the new value.
         """
         try:
-            ttl_arg = str(ttl) if ttl is not None else "nil"
-            result = self._redis.eval(LUA_INCREMENT_SCRIPT, 1, key, str(amount), ttl_arg)
+            result = self._run_script(LUA_INCREMENT_SCRIPT, LUA_INCREMENT_SHA, 1, key, *_increment_args(amount, ttl))
             return float(result)
         except RedisError as e:
             logger.error("Redis INCRBYFLOAT error for key {} (owner: {}): {}", key, owner_id, e)
             raise
+
+    def increment_many(self, amounts: Dict[str, float], owner_id: str, ttl: Optional[int] = None) -> List[float]:
+        """
+        Atomically increment each key by its amount in a single round-trip.
+        Either every key is incremented or none is. Returns the new values in key order.
+        """
+        try:
+            results = self._run_script(
+                LUA_INCREMENT_MANY_SCRIPT, LUA_INCREMENT_MANY_SHA, *_increment_many_args(amounts, ttl)
+            )
+            return [float(result) for result in results]
+        except RedisError as e:
+            logger.error("Redis INCRBYFLOAT error for keys {} (owner: {}): {}", list(amounts), owner_id, e)
+            raise
+
+    def increment_within_limits(
+        self, limits: Dict[str, float], amount: float, owner_id: str, ttl: Optional[int] = None
+    ) -> Optional[Tuple[str, float]]:
+        """
+        Atomically increment every key by amount, unless that would take any key past its limit.
+        Keys are checked in order. Returns (key, current usage) for the first one that would exceed,
+        in which case nothing is written, or None once every key has been incremented.
+        """
+        try:
+            result = self._run_script(
+                LUA_INCREMENT_WITHIN_LIMITS_SCRIPT,
+                LUA_INCREMENT_WITHIN_LIMITS_SHA,
+                *_increment_within_limits_args(limits, amount, ttl),
+            )
+        except RedisError as e:
+            logger.error("Redis INCRBYFLOAT error for keys {} (owner: {}): {}", list(limits), owner_id, e)
+            raise
+        if result[0] == 0:
+            return None
+        return list(limits)[result[0] - 1], float(result[1])
+
+    def _run_script(self, script: str, sha: str, *args: Any) -> Any:
+        """EVALSHA a script by digest, loading it first if Redis does not have it cached."""
+        try:
+            return self._redis.evalsha(sha, *args)
+        except NoScriptError:
+            # Script cache is empty (first use or SCRIPT FLUSH): nothing ran, so load and replay
+            self._redis.script_load(script)
+            return self._redis.evalsha(sha, *args)
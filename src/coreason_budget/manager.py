@@ -3,9 +3,10 @@ from typing import Optional
 from coreason_identity.models import UserContext
 
 from coreason_budget.config import CoreasonBudgetConfig
-from coreason_budget.guard import BudgetGuard, SyncBudgetGuard
+from coreason_budget.guard import BudgetGuard, Spend, SyncBudgetGuard
 from coreason_budget.ledger import RedisLedger, SyncRedisLedger
 from coreason_budget.pricing import PricingEngine
+from coreason_budget.spend_queue import SpendQueue
 from coreason_budget.validation import validate_check_availability_inputs, validate_record_spend_inputs
 
 
@@ -20,11 +21,12 @@ class BudgetManager:
         self.config = config
 
         # Async Components
-        self._async_ledger = RedisLedger(config.redis_url)
+        self._async_ledger = RedisLedger(config.redis_url, config.redis_max_connections)
         self.guard = BudgetGuard(config, self._async_ledger)
+        self.spend_queue = SpendQueue(self.guard)
 
         # Sync Components
-        self._sync_ledger = SyncRedisLedger(config.redis_url)
+        self._sync_ledger = SyncRedisLedger(config.redis_url, config.redis_max_connections)
         self.sync_guard = SyncBudgetGuard(config, self._sync_ledger)
 
         self.pricing = PricingEngine(config)
@@ -47,6 +49,25 @@ class BudgetManager:
         validate_check_availability_inputs(user_context.user_id)
         return self.sync_guard.check(user_context, project_id, estimated_cost)
 
+    async def check_and_spend(
+        self, user_context: UserContext, cost: float, project_id: Optional[str] = None, model: Optional[str] = None
+    ) -> None:
+        """
+        Check availability and record spend asynchronously, atomically.
+        Concurrent callers cannot both pass the check and then overshoot a limit together.
+        """
+        validate_record_spend_inputs(user_context.user_id, cost, project_id, model)
+        await self.guard.check_and_charge(user_context, cost, project_id, model)
+
+    def check_and_spend_sync(
+        self, user_context: UserContext, cost: float, project_id: Optional[str] = None, model: Optional[str] = None
+    ) -> None:
+        """
+        Check availability and record spend synchronously, atomically.
+        """
+        validate_record_spend_inputs(user_context.user_id, cost, project_id, model)
+        self.sync_guard.check_and_charge(user_context, cost, project_id, model)
+
     async def record_spend(
         self, user_context: UserContext, cost: float, project_id: Optional[str] = None, model: Optional[str] = None
     ) -> None:
@@ -56,6 +77,23 @@ class BudgetManager:
         validate_record_spend_inputs(user_context.user_id, cost, project_id, model)
         await self.guard.charge(user_context, cost, project_id, model)
 
+    def record_spend_background(
+        self, user_context: UserContext, cost: float, project_id: Optional[str] = None, model: Optional[str] = None
+    ) -> None:
+        """
+        Queue spend for background recording and return without waiting for Redis.
+        Must be called from a running event loop. Write errors are logged, not raised;
+        await flush() where the spend must be visible before continuing.
+        """
+        validate_record_spend_inputs(user_context.user_id, cost, project_id, model)
+        self.spend_queue.put(Spend(user_context, cost, project_id, model))
+
+    async def flush(self) -> None:
+        """
+        Wait for all spend queued by record_spend_background to be written.
+        """
+        await self.spend_queue.flush()
+
     def record_spend_sync(
         self, user_context: UserContext, cost: float, project_id: Optional[str] = None, model: Optional[str] = None
     ) -> None:
@@ -69,5 +107,6 @@ class BudgetManager:
         """
         Cleanup resources.
         """
+        await self.spend_queue.flush()
         await self._async_ledger.close()
         self._sync_ledger.close()
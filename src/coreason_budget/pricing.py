@@ -1,8 +1,33 @@
-import litellm
+import time
+from functools import lru_cache
 
 from coreason_budget.config import CoreasonBudgetConfig
 from coreason_budget.utils.logger import logger
 
+# Distinct (model, input_tokens, output_tokens) triples remembered per engine
+LITELLM_COST_CACHE_SIZE = 10_000
+# Longest a cached liteLLM price may be served. liteLLM can change prices at runtime
+# (litellm.register_model, its background refresh of the remote cost map).
+LITELLM_COST_CACHE_TTL_SECONDS = 60.0
+
+
+def _litellm_cost(model: str, input_tokens: int, output_tokens: int, ttl_bucket: int) -> float:
+    """
+    Price usage with liteLLM's tables. Failures propagate and are never cached.
+    ttl_bucket is only part of the cache key: it moves on every LITELLM_COST_CACHE_TTL_SECONDS.
+    """
+    # Imported here: liteLLM is slow to import and only needed without an override
+    import litellm
+
+    cost = litellm.completion_cost(
+        model=model,
+        prompt=None,  # We can pass tokens directly
+        completion=None,
+        total_input_tokens=input_tokens,
+        total_output_tokens=output_tokens,
+    )
+    return float(cost)
+
 
 class PricingEngine:
     """
@@ -11,6 +36,12 @@ class PricingEngine:
 
     def __init__(self, config: CoreasonBudgetConfig) -> None:
         self.config = config
+        # Repeated usage shapes are priced once per TTL window; see clear_cache for immediate updates
+        self._litellm_cost = lru_cache(maxsize=LITELLM_COST_CACHE_SIZE)(_litellm_cost)
+
+    def clear_cache(self) -> None:
+        """Forget cached liteLLM prices, e.g. right after litellm.register_model()."""
+        self._litellm_cost.cache_clear()
 
     def calculate(
         self,
@@ -23,8 +54,9 @@ class PricingEngine:
         Checks for overrides first, then falls back to liteLLM.
         """
         # 1. Check for overrides
-        if model in self.config.model_price_overrides:
-            override = self.config.model_price_overrides[model]
+        # Read on every call: overrides may be reassigned or edited in place at runtime
+        override = self.config.model_price_overrides.get(model)
+        if override is not None:
             input_cost_per_token = override.get("input_cost_per_token", 0.0)
             output_cost_per_token = override.get("output_cost_per_token", 0.0)
 
@@ -34,16 +66,8 @@ class PricingEngine:
 
         # 2. Use liteLLM
         try:
-            # completion_cost returns float or Decimal? Usually float.
-            # liteLLM docs say it returns cost as float.
-            cost = litellm.completion_cost(
-                model=model,
-                prompt=None,  # We can pass tokens directly
-                completion=None,
-                total_input_tokens=input_tokens,
-                total_output_tokens=output_tokens,
-            )
-            return float(cost)
+            ttl_bucket = int(time.monotonic() // LITELLM_COST_CACHE_TTL_SECONDS)
+            return self._litellm_cost(model, input_tokens, output_tokens, ttl_bucket)
         except Exception as e:
             logger.error("Failed to calculate cost for model {}: {}", model, e)
             raise ValueError(f"Could not calculate cost for model {model}: {e}") from e
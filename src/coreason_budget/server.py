@@ -1,3 +1,5 @@
+import asyncio
+import time
 from contextlib import asynccontextmanager
 from typing import AsyncGenerator, Dict, Optional
 
@@ -11,6 +13,9 @@ from coreason_budget.exceptions import BudgetExceededError
 from coreason_budget.manager import BudgetManager
 from coreason_budget.utils.logger import logger
 
+# /health reuses a Redis ping result for this long, so bursts of load-balancer probes cost one round-trip
+HEALTH_CACHE_TTL_SECONDS = 1.0
+
 
 class CheckBudgetRequest(BaseModel):  # type: ignore[misc]
     user_id: Optional[str] = None
@@ -53,6 +58,10 @@ async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
     # However, BudgetManager._async_ledger uses redis-py which handles connection.
 
     app.state.budget = budget_manager
+    # (monotonic time of the last ping, whether it succeeded); None until /health is first hit
+    app.state.last_ping = None
+    # The /health ping currently in flight, shared by concurrent probes
+    app.state.ping_task = None
     yield
     logger.info("Closing BudgetManager...")
     await budget_manager.close()
@@ -85,9 +94,19 @@ async def check_budget(
 async def record_spend(
     request: RecordSpendRequest,
     user_context: UserContext = Depends(get_user_context),  # noqa: B008
+    background: bool = False,
 ) -> Dict[str, str]:
     budget: BudgetManager = app.state.budget
     try:
+        if background:
+            # Respond once the spend is queued; the write happens after the response
+            budget.record_spend_background(
+                user_context=user_context,
+                cost=request.cost,
+                project_id=request.project_id,
+                model=request.model,
+            )
+            return {"status": "queued"}
         await budget.record_spend(
             user_context=user_context,
             cost=request.cost,
@@ -100,13 +119,36 @@ async def record_spend(
         raise HTTPException(status_code=400, detail=str(e)) from e
 
 
-@app.get("/health")
-async def health_check() -> Dict[str, str]:
-    budget: BudgetManager = app.state.budget
+async def _ping_redis(budget: BudgetManager, now: float) -> tuple[float, bool]:
+    """Ping Redis once and publish the result as app.state.last_ping."""
     try:
         # Accessing private member _async_ledger as per plan/requirements suggestion
         # Ideally we might want a public method, but we are inside the package.
         await budget._async_ledger._redis.ping()
-        return {"status": "healthy", "redis": "connected"}
+        last_ping = (now, True)
     except (RedisError, ConnectionError, Exception) as e:
-        raise HTTPException(status_code=503, detail="Redis connection failed") from e
+        logger.error("Health check ping failed: {}", e)
+        last_ping = (now, False)
+    finally:
+        app.state.ping_task = None
+    app.state.last_ping = last_ping
+    return last_ping
+
+
+@app.get("/health")
+async def health_check() -> Dict[str, str]:
+    budget: BudgetManager = app.state.budget
+    now = time.monotonic()
+    last_ping: Optional[tuple[float, bool]] = app.state.last_ping
+    if last_ping is None or now - last_ping[0] >= HEALTH_CACHE_TTL_SECONDS:
+        # Probes arriving while a ping is in flight wait for it instead of sending their own
+        ping_task: Optional[asyncio.Task[tuple[float, bool]]] = app.state.ping_task
+        if ping_task is None:
+            ping_task = asyncio.create_task(_ping_redis(budget, now))
+            app.state.ping_task = ping_task
+        # Shielded so a probe that disconnects does not cancel the ping the others are waiting on
+        last_ping = await asyncio.shield(ping_task)
+
+    if not last_ping[1]:
+        raise HTTPException(status_code=503, detail="Redis connection failed")
+    return {"status": "healthy", "redis": "connected"}
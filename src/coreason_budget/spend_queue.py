@@ -0,0 +1,79 @@
+# Copyright (c) 2025 CoReason, Inc.
+#
+# This software is proprietary and dual-licensed.
+# Licensed under the Prosperity Public License 3.0 (the "License").
+# A copy of the license is available at https://prosperitylicense.com/versions/3.0.0
+# For details, see the LICENSE file.
+# Commercial use beyond a 30-day trial requires a separate license.
+#
+# Source Code: https://github.com/CoReason-AI/coreason_budget
+
+import asyncio
+from typing import List, Optional
+
+from redis.exceptions import ResponseError
+
+from coreason_budget.guard import BudgetGuard, Spend
+from coreason_budget.utils.logger import logger
+
+DEFAULT_MAX_BATCH = 256
+
+
+class SpendQueue:
+    """
+    Records spend in the background.
+    put() returns immediately; one worker task drains whatever has been queued into a single
+    BudgetGuard.charge_many call, so spends arriving while a write is in flight share the next one.
+    A spend that Redis rejects only fails itself, not the others batched with it.
+    """
+
+    def __init__(self, guard: BudgetGuard, max_batch: int = DEFAULT_MAX_BATCH) -> None:
+        self.guard = guard
+        self.max_batch = max_batch
+        self._queue: asyncio.Queue[Spend] = asyncio.Queue()
+        self._worker: Optional[asyncio.Task[None]] = None
+
+    def put(self, spend: Spend) -> None:
+        """
+        Queue a spend without waiting for Redis.
+        Must be called from a running event loop.
+        """
+        self._queue.put_nowait(spend)
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.get_running_loop().create_task(self._drain())
+
+    async def flush(self) -> None:
+        """Wait until every spend queued so far has been written, or has failed and been logged."""
+        await self._queue.join()
+
+    async def _drain(self) -> None:
+        # Exits once the queue is empty; put() starts a new worker for the next spend
+        while not self._queue.empty():
+            batch: List[Spend] = []
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            try:
+                errors = await self._charge(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if errors:
+                # Nobody is awaiting these spends, so the failure can only be reported
+                logger.error("Failed to record {} queued spends: {}", len(errors), errors[0])
+
+    async def _charge(self, spends: List[Spend]) -> List[Exception]:
+        """Write spends together; returns one error per spend that was not recorded."""
+        try:
+            await self.guard.charge_many(spends)
+        except ResponseError as e:
+            if len(spends) == 1:
+                return [e]
+            # Redis rejected the script before it wrote anything (e.g. one corrupt key), so no spend was
+            # recorded. Write them one at a time so a bad key only fails the spends that touch it.
+            errors: List[Exception] = []
+            for spend in spends:
+                errors.extend(await self._charge([spend]))
+            return errors
+        except Exception as e:
+            return [e] * len(spends)
+        return []
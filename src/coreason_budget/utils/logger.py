@@ -1,27 +1,37 @@
 import os
 import sys
+from typing import Optional
 
 from loguru import logger
 
+
+def _configure(log_path: Optional[str] = None) -> None:
+    """Install the console and JSON file handlers, replacing any existing ones."""
+    level = os.getenv("LOG_LEVEL", "INFO")
+    if log_path is None:
+        log_path = os.getenv("COREASON_BUDGET_LOG_PATH", "logs/app.log")
+
+    # Remove default handler
+    logger.remove()
+
+    # Add console handler
+    logger.add(sys.stderr, level=level)
+
+    # Add file handler
+    # Ensure logs directory exists
+    os.makedirs(os.path.dirname(log_path), exist_ok=True)
+
+    logger.add(
+        log_path,
+        rotation="500 MB",
+        retention="10 days",
+        level=level,
+        serialize=True,  # JSON format
+    )
+
+
 # Configure logger
-# Remove default handler
-logger.remove()
-
-# Add console handler
-logger.add(sys.stderr, level=os.getenv("LOG_LEVEL", "INFO"))
-
-# Add file handler
-# Ensure logs directory exists
-log_path = os.getenv("COREASON_BUDGET_LOG_PATH", "logs/app.log")
-os.makedirs(os.path.dirname(log_path), exist_ok=True)
-
-logger.add(
-    log_path,
-    rotation="500 MB",
-    retention="10 days",
-    level=os.getenv("LOG_LEVEL", "INFO"),
-    serialize=True,  # JSON format
-)
+_configure()
 
 # Export logger
 __all__ = ["logger"]
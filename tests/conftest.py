@@ -8,23 +8,120 @@
 #
 # Source Code: https://github.com/CoReason-AI/coreason_budget
 
-from typing import AsyncGenerator
+import asyncio
+import os
+import sys
+from contextlib import AsyncExitStack
+from typing import Any, AsyncGenerator, Dict, Generator, List, cast
+from unittest.mock import patch
 
+import fakeredis
+import httpx
+import pytest
 import pytest_asyncio
 from fakeredis import aioredis
 
 from coreason_budget import BudgetConfig, BudgetManager
+from coreason_budget.ledger import RedisLedger
+from coreason_budget.server import app, lifespan
+from coreason_budget.utils.logger import logger
 
 
-@pytest_asyncio.fixture
-async def manager() -> AsyncGenerator[BudgetManager, None]:
-    config = BudgetConfig(redis_url="redis://localhost:6379", daily_user_limit_usd=10.0)
-    mgr = BudgetManager(config)
+@pytest.fixture(scope="session")
+def event_loop_policy() -> asyncio.AbstractEventLoopPolicy:
+    # uvloop has no Windows build; fall back to the default loop there.
+    if sys.platform == "win32":  # pragma: no cover
+        return asyncio.DefaultEventLoopPolicy()
+    import uvloop
 
-    # Let's manually inject a fake redis client into the ledger
-    # Updated: BudgetManager no longer exposes .ledger directly, it has ._async_ledger
-    # And ._async_ledger._redis
-    mgr._async_ledger._redis = aioredis.FakeRedis(decode_responses=True)
+    return cast(asyncio.AbstractEventLoopPolicy, uvloop.EventLoopPolicy())
+
+
+@pytest.fixture
+def log_sink() -> Generator[List[Dict[str, Any]], None, None]:
+    # Captures the loguru records emitted during the test, without touching the configured handlers
+    records: List[Dict[str, Any]] = []
+    handler_id = logger.add(lambda message: records.append(dict(message.record)), level="DEBUG")
+    yield records
+    logger.remove(handler_id)
+
+
+@pytest.fixture(scope="session")
+def fake_server() -> fakeredis.FakeServer:
+    # Session scope gives each xdist worker process its own in-memory server
+    return fakeredis.FakeServer()
+
+
+@pytest.fixture
+def fake_redis(fake_server: fakeredis.FakeServer) -> fakeredis.FakeAsyncRedis:
+    # Async client on the shared server, for handing to a ledger and inspecting what it wrote
+    return fakeredis.FakeAsyncRedis(server=fake_server, decode_responses=True)
+
+
+@pytest.fixture(autouse=True)
+def _clean_fake_server(fake_server: fakeredis.FakeServer) -> Generator[None, None, None]:
+    yield
+    fake_server.connected = True
+    with fake_server.lock:
+        for db in fake_server.dbs.values():
+            db.clear()
+
+
+@pytest.fixture(scope="module")
+def manager_config() -> BudgetConfig:
+    # Modules override this fixture to run the shared `manager` under their own limits
+    return BudgetConfig(redis_url="redis://localhost:6379", daily_user_limit_usd=10.0)
+
+
+@pytest_asyncio.fixture(scope="module")
+async def manager(
+    fake_server: fakeredis.FakeServer, manager_config: BudgetConfig
+) -> AsyncGenerator[BudgetManager, None]:
+    # One manager per module; `_clean_fake_server` still wipes Redis state after every test
+    mgr = BudgetManager(manager_config)
+
+    # Both ledgers talk to the shared fake server, so sync and async writes land in one place
+    mgr._async_ledger._redis = aioredis.FakeRedis(server=fake_server)
+    mgr._sync_ledger._redis = fakeredis.FakeRedis(server=fake_server)
 
     yield mgr
     await mgr.close()
+
+
+@pytest_asyncio.fixture(scope="session")
+async def _session_ledger(fake_server: fakeredis.FakeServer) -> AsyncGenerator[RedisLedger, None]:
+    # One FakeRedis-backed ledger for the whole session, on the shared server
+    fake_redis = aioredis.FakeRedis(server=fake_server)
+    with patch("coreason_budget.ledger._async_client", return_value=fake_redis):
+        ledger = RedisLedger("redis://localhost")
+    yield ledger
+    await ledger.close()
+
+
+@pytest.fixture
+def ledger(_session_ledger: RedisLedger) -> RedisLedger:
+    return _session_ledger
+
+
+@pytest_asyncio.fixture(scope="session")
+async def _session_app_client(fake_server: fakeredis.FakeServer) -> AsyncGenerator[httpx.AsyncClient, None]:
+    # The server app is started once per session on the shared server; ASGITransport skips the
+    # lifespan, so it is entered here by hand. The patches are only needed while startup builds the
+    # manager, so they are undone before any test runs.
+    env = {"COREASON_BUDGET_REDIS_URL": "redis://localhost:6379"}
+    async with AsyncExitStack() as stack:
+        with (
+            patch.dict(os.environ, env),
+            patch("coreason_budget.ledger._async_client", return_value=aioredis.FakeRedis(server=fake_server)),
+        ):
+            await stack.enter_async_context(lifespan(app))
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as client:
+            yield client
+
+
+@pytest.fixture
+def app_client(_session_app_client: httpx.AsyncClient) -> httpx.AsyncClient:
+    # Redis is wiped by `_clean_fake_server`; the cached health result must not leak between tests either
+    app.state.last_ping = None
+    return _session_app_client
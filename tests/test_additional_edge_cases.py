@@ -1,7 +1,8 @@
+import re
+import sys
 from unittest.mock import patch
 
 import fakeredis
-import fakeredis.aioredis
 import pytest
 from coreason_identity.models import UserContext
 
@@ -9,9 +10,15 @@ from coreason_budget.config import CoreasonBudgetConfig
 from coreason_budget.exceptions import BudgetExceededError, RedisConnectionError
 from coreason_budget.manager import BudgetManager
 
+_GLOBAL_RE = re.compile(r"Global daily limit exceeded")
+_PROJECT_RE = re.compile(r"Project daily limit exceeded")
+_USER_RE = re.compile(r"User daily limit exceeded")
+_NOT_FLOAT_RE = re.compile(r"could not convert string to float: b'not-a-number'")
 
-@pytest.fixture
-def config() -> CoreasonBudgetConfig:
+
+@pytest.fixture(scope="module")
+def manager_config() -> CoreasonBudgetConfig:
+    # Limits for this module's shared `manager`
     return CoreasonBudgetConfig(
         redis_url="redis://localhost",
         daily_global_limit_usd=1000.0,
@@ -24,100 +31,81 @@ def create_context(user_id: str) -> UserContext:
     return UserContext(user_id=user_id, email=f"{user_id}@example.com", groups=[], scopes=[], claims={})
 
 
-@pytest.mark.asyncio
-async def test_hierarchy_strictness(config: CoreasonBudgetConfig) -> None:
-    fake_redis = fakeredis.aioredis.FakeRedis(decode_responses=True)
-    with (
-        patch("coreason_budget.ledger.from_url", return_value=fake_redis),
-        patch("coreason_budget.ledger.sync_from_url"),
-    ):
-        mgr = BudgetManager(config)
-        user_id = "hierarchy_user"
-        context = create_context(user_id)
-        project_id = "hierarchy_project"
-
-        # Scenario 1: User limit exceeded
-        await fake_redis.set(f"budget:user:{user_id}:{mgr.guard._get_date_str()}", 101.0)
-        with pytest.raises(BudgetExceededError, match="User daily limit exceeded"):
-            await mgr.check_availability(context, project_id, 1.0)
+async def test_hierarchy_strictness(manager: BudgetManager, fake_redis: fakeredis.FakeAsyncRedis) -> None:
+    user_id = "hierarchy_user"
+    context = create_context(user_id)
+    project_id = "hierarchy_project"
 
-        await fake_redis.flushall()
+    keys = manager.guard._get_keys(user_id, project_id)
 
-        # Scenario 2: Project limit exceeded
-        await fake_redis.set(f"budget:user:{user_id}:{mgr.guard._get_date_str()}", 10.0)
-        await fake_redis.set(f"budget:project:{project_id}:{mgr.guard._get_date_str()}", 501.0)
-        with pytest.raises(BudgetExceededError, match="Project daily limit exceeded"):
-            await mgr.check_availability(context, project_id, 1.0)
+    # Scenario 1: User limit exceeded
+    await fake_redis.set(keys["user"], 101.0)
+    with pytest.raises(BudgetExceededError, match=_USER_RE):
+        await manager.check_availability(context, project_id, 1.0)
 
-        await fake_redis.flushall()
+    await fake_redis.flushall()
 
-        # Scenario 3: Global limit exceeded
-        await fake_redis.set(f"budget:user:{user_id}:{mgr.guard._get_date_str()}", 10.0)
-        await fake_redis.set(f"budget:project:{project_id}:{mgr.guard._get_date_str()}", 100.0)
-        await fake_redis.set(f"budget:global:{mgr.guard._get_date_str()}", 1001.0)
-        with pytest.raises(BudgetExceededError, match="Global daily limit exceeded"):
-            await mgr.check_availability(context, project_id, 1.0)
+    # Scenario 2: Project limit exceeded
+    await fake_redis.set(keys["user"], 10.0)
+    await fake_redis.set(keys["project"], 501.0)
+    with pytest.raises(BudgetExceededError, match=_PROJECT_RE):
+        await manager.check_availability(context, project_id, 1.0)
 
-        await mgr.close()
+    await fake_redis.flushall()
 
+    # Scenario 3: Global limit exceeded
+    await fake_redis.set(keys["user"], 10.0)
+    await fake_redis.set(keys["project"], 100.0)
+    await fake_redis.set(keys["global"], 1001.0)
+    with pytest.raises(BudgetExceededError, match=_GLOBAL_RE):
+        await manager.check_availability(context, project_id, 1.0)
 
-@pytest.mark.asyncio
-async def test_corrupted_data_handling(config: CoreasonBudgetConfig) -> None:
-    fake_redis = fakeredis.aioredis.FakeRedis(decode_responses=True)
-    with (
-        patch("coreason_budget.ledger.from_url", return_value=fake_redis),
-        patch("coreason_budget.ledger.sync_from_url"),
-    ):
-        mgr = BudgetManager(config)
-        user_id = "corrupt_user"
-        context = create_context(user_id)
 
-        key = f"budget:user:{user_id}:{mgr.guard._get_date_str()}"
-        await fake_redis.set(key, "not-a-number")
+async def test_corrupted_data_handling(manager: BudgetManager, fake_redis: fakeredis.FakeAsyncRedis) -> None:
+    user_id = "corrupt_user"
+    context = create_context(user_id)
 
-        with pytest.raises(ValueError):
-            await mgr.check_availability(context, estimated_cost=1.0)
+    key = manager.guard._get_keys(user_id)["user"]
+    await fake_redis.set(key, "not-a-number")
 
-        await mgr.close()
+    # The ledger sees raw bytes, as in production, and still refuses to guess
+    with pytest.raises(ValueError, match=_NOT_FLOAT_RE):
+        await manager.check_availability(context, estimated_cost=1.0)
 
 
-@pytest.mark.asyncio
-async def test_sync_async_interoperability(config: CoreasonBudgetConfig) -> None:
-    server = fakeredis.FakeServer()
-    async_fake = fakeredis.aioredis.FakeRedis(server=server, decode_responses=True)
-    sync_fake = fakeredis.FakeRedis(server=server, decode_responses=True)
+async def test_sync_async_interoperability(manager: BudgetManager) -> None:
+    context = create_context("interop_user")
 
-    with (
-        patch("coreason_budget.ledger.from_url", return_value=async_fake),
-        patch("coreason_budget.ledger.sync_from_url", return_value=sync_fake),
-    ):
-        mgr = BudgetManager(config)
-        user_id = "interop_user"
-        context = create_context(user_id)
+    manager.record_spend_sync(context, 10.0)
 
-        mgr.record_spend_sync(context, 10.0)
+    result = await manager.check_availability(context, estimated_cost=80.0)
+    assert result is True
 
-        result = await mgr.check_availability(context, estimated_cost=80.0)
-        assert result is True
+    with pytest.raises(BudgetExceededError):
+        await manager.check_availability(context, estimated_cost=91.0)
 
-        with pytest.raises(BudgetExceededError):
-            await mgr.check_availability(context, estimated_cost=91.0)
+    await manager.record_spend(context, 20.0)
 
-        await mgr.record_spend(context, 20.0)
+    with pytest.raises(BudgetExceededError):
+        manager.check_availability_sync(context, estimated_cost=71.0)
 
-        with pytest.raises(BudgetExceededError):
-            mgr.check_availability_sync(context, estimated_cost=71.0)
 
-        await mgr.close()
+async def test_fail_closed_connection_error(manager: BudgetManager) -> None:
+    with patch("coreason_budget.ledger.RedisLedger.get_usage_many", side_effect=RedisConnectionError("Fail")):
+        with pytest.raises(RedisConnectionError):
+            await manager.check_availability(create_context("user1"))
 
 
-@pytest.mark.asyncio
-async def test_fail_closed_connection_error(config: CoreasonBudgetConfig) -> None:
-    with patch("coreason_budget.ledger.RedisLedger.get_usage", side_effect=RedisConnectionError("Fail")):
-        mgr = BudgetManager(config)
-        context = create_context("user1")
+@pytest.mark.parametrize("cost", [1_000_000.0, 1e18, sys.float_info.max])
+async def test_very_large_cost_is_rejected(
+    manager: BudgetManager, fake_redis: fakeredis.FakeAsyncRedis, cost: float
+) -> None:
+    context = create_context("large_cost_user")
 
-        with pytest.raises(RedisConnectionError):
-            await mgr.check_availability(context)
+    with pytest.raises(BudgetExceededError, match=_GLOBAL_RE):
+        await manager.check_availability(context, estimated_cost=cost)
 
-        await mgr.close()
+    # The atomic path rejects it inside Redis without writing anything
+    with pytest.raises(BudgetExceededError, match=_GLOBAL_RE):
+        await manager.check_and_spend(context, cost)
+    assert await fake_redis.keys("*large_cost_user*") == []
@@ -1,18 +1,26 @@
 import asyncio
-from datetime import datetime
+import re
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, cast
 from unittest.mock import patch
 
-import fakeredis.aioredis
+import fakeredis
 import pytest
 from coreason_identity.models import UserContext
+from redis.exceptions import ResponseError
 
 from coreason_budget.config import CoreasonBudgetConfig
 from coreason_budget.exceptions import BudgetExceededError
 from coreason_budget.manager import BudgetManager
 
+_PROJECT_ID_RE = re.compile(r"project_id must be a non-empty string")
+_NOT_FLOAT_RE = re.compile(r"value is not a valid float")
 
-@pytest.fixture
-def config() -> CoreasonBudgetConfig:
+
+@pytest.fixture(scope="module")
+def manager_config() -> CoreasonBudgetConfig:
+    # Limits for this module's shared `manager`
     return CoreasonBudgetConfig(
         redis_url="redis://localhost", daily_user_limit_usd=100.0, daily_global_limit_usd=1000.0
     )
@@ -22,116 +30,108 @@ def create_context(user_id: str) -> UserContext:
     return UserContext(user_id=user_id, email=f"{user_id}@example.com", groups=[], scopes=[], claims={})
 
 
-@pytest.mark.asyncio
-async def test_concurrency_race_condition(config: CoreasonBudgetConfig) -> None:
-    fake_redis = fakeredis.aioredis.FakeRedis(decode_responses=True)
-    with (
-        patch("coreason_budget.ledger.from_url", return_value=fake_redis),
-        patch("coreason_budget.ledger.sync_from_url"),
-    ):
-        mgr = BudgetManager(config)
-        user_id = "concurrent_user"
-        context = create_context(user_id)
+async def test_concurrency_race_condition(manager: BudgetManager, fake_redis: fakeredis.FakeAsyncRedis) -> None:
+    user_id = "concurrent_user"
+    context = create_context(user_id)
 
-        tasks = [mgr.record_spend(context, 1.0) for _ in range(100)]
-        await asyncio.gather(*tasks)
+    tasks = [manager.record_spend(context, 1.0) for _ in range(100)]
+    await asyncio.gather(*tasks)
 
-        keys = await fake_redis.keys("*")
-        user_key = next(k for k in keys if f"user:{user_id}" in k)
+    user_key = manager.guard._get_keys(user_id)["user"]
 
-        val = await fake_redis.get(user_key)
-        assert float(val) == 100.0
+    val = await fake_redis.get(user_key)
+    assert float(cast(str, val)) == 100.0
 
-        await mgr.close()
 
+async def test_check_and_spend_race(manager: BudgetManager, fake_redis: fakeredis.FakeAsyncRedis) -> None:
+    context = create_context("racing_user")
 
-@pytest.mark.asyncio
-async def test_refund_logic(config: CoreasonBudgetConfig) -> None:
-    fake_redis = fakeredis.aioredis.FakeRedis(decode_responses=True)
-    with (
-        patch("coreason_budget.ledger.from_url", return_value=fake_redis),
-        patch("coreason_budget.ledger.sync_from_url"),
-    ):
-        mgr = BudgetManager(config)
-        user_id = "refund_user"
-        context = create_context(user_id)
+    # Each call checks and charges atomically, so the limit cannot be overshot
+    results = await asyncio.gather(*[manager.check_and_spend(context, 1.0) for _ in range(150)], return_exceptions=True)
+    assert results.count(None) == 100
+    assert all(isinstance(r, BudgetExceededError) for r in results if r is not None)
 
-        await mgr.record_spend(context, 50.0)
-        await mgr.record_spend(context, -20.0)
+    with pytest.raises(BudgetExceededError):
+        manager.check_and_spend_sync(context, 1.0)
 
-        assert await mgr.check_availability(context, estimated_cost=60.0) is True
+    user_key = manager.guard._get_keys("racing_user")["user"]
+    assert float(cast(str, await fake_redis.get(user_key))) == 100.0
 
-        with pytest.raises(BudgetExceededError):
-            await mgr.check_availability(context, estimated_cost=80.0)
 
-        await mgr.close()
+async def test_refund_logic(manager: BudgetManager) -> None:
+    context = create_context("refund_user")
 
+    await manager.record_spend(context, 50.0)
+    await manager.record_spend(context, -20.0)
 
-@pytest.mark.asyncio
-async def test_floating_point_precision(config: CoreasonBudgetConfig) -> None:
-    fake_redis = fakeredis.aioredis.FakeRedis(decode_responses=True)
-    with (
-        patch("coreason_budget.ledger.from_url", return_value=fake_redis),
-        patch("coreason_budget.ledger.sync_from_url"),
-    ):
-        mgr = BudgetManager(config)
-        user_id = "float_user"
-        context = create_context(user_id)
+    assert await manager.check_availability(context, estimated_cost=60.0) is True
 
-        for _ in range(10):
-            await mgr.record_spend(context, 0.0000001)
+    with pytest.raises(BudgetExceededError):
+        await manager.check_availability(context, estimated_cost=80.0)
 
-        keys = await fake_redis.keys(f"*user:{user_id}*")
-        val = await fake_redis.get(keys[0])
 
-        assert float(val) == pytest.approx(0.000001)
+async def test_partial_failure_is_all_or_nothing(manager: BudgetManager, fake_redis: fakeredis.FakeAsyncRedis) -> None:
+    context = create_context("partial_user")
+    keys = manager.guard._get_keys("partial_user", "proj1")
 
-        await mgr.close()
+    # The project key is written after global in the batch; corrupting it must not leave global charged
+    await fake_redis.set(keys["project"], "not-a-number")
+    with pytest.raises(ResponseError, match=_NOT_FLOAT_RE):
+        await manager.record_spend(context, 5.0, project_id="proj1")
 
+    assert await fake_redis.mget(keys["global"], keys["user"]) == [None, None]
 
-@pytest.mark.asyncio
-async def test_zero_cost(config: CoreasonBudgetConfig) -> None:
-    fake_redis = fakeredis.aioredis.FakeRedis(decode_responses=True)
-    with (
-        patch("coreason_budget.ledger.from_url", return_value=fake_redis),
-        patch("coreason_budget.ledger.sync_from_url"),
-    ):
-        mgr = BudgetManager(config)
-        user_id = "zero_user"
-        context = create_context(user_id)
 
-        await mgr.record_spend(context, 0.0)
+async def test_floating_point_precision(manager: BudgetManager, fake_redis: fakeredis.FakeAsyncRedis) -> None:
+    user_id = "float_user"
+    context = create_context(user_id)
+
+    for _ in range(10):
+        await manager.record_spend(context, 0.0000001)
 
-        keys = await fake_redis.keys(f"*user:{user_id}*")
-        assert len(keys) == 1
-        val = await fake_redis.get(keys[0])
-        assert float(val) == 0.0
+    keys = await fake_redis.keys(f"*user:{user_id}*")
+    val = await fake_redis.get(keys[0])
 
-        await mgr.close()
+    assert float(cast(str, val)) == pytest.approx(0.000001)
 
 
-@pytest.mark.asyncio
-async def test_ttl_near_midnight(config: CoreasonBudgetConfig) -> None:
-    fake_redis = fakeredis.aioredis.FakeRedis(decode_responses=True)
+async def test_zero_cost(
+    manager: BudgetManager, fake_redis: fakeredis.FakeAsyncRedis, log_sink: List[Dict[str, Any]]
+) -> None:
+    user_id = "zero_user"
+    context = create_context(user_id)
 
-    mock_now = datetime(2023, 10, 27, 23, 59, 0)
+    # A zero spend adds nothing on any path, so nothing reaches Redis
+    await manager.record_spend(context, 0.0)
+    manager.record_spend_background(context, 0.0)
+    manager.record_spend_sync(context, 0.0)
+    await manager.flush()
 
-    with (
-        patch("coreason_budget.ledger.from_url", return_value=fake_redis),
-        patch("coreason_budget.ledger.sync_from_url"),
-        patch("coreason_budget.guard.datetime") as mock_datetime,
-    ):
-        mock_datetime.now.return_value = mock_now
+    assert await fake_redis.keys(f"*user:{user_id}*") == []
+
+    # Each one is still reported to FinOps
+    recorded = [r for r in log_sink if r["message"] == "Transaction Recorded"]
+    assert len(recorded) == 3
+    assert all(r["extra"]["extra"]["cost_usd"] == 0.0 for r in recorded)
+
+    # Validation still runs first
+    with pytest.raises(ValueError, match=_PROJECT_ID_RE):
+        await manager.record_spend(context, 0.0, project_id="")
+
+
+async def test_ttl_near_midnight(manager: BudgetManager, fake_redis: fakeredis.FakeAsyncRedis) -> None:
+    mock_now = datetime(2023, 10, 27, 23, 59, 0, tzinfo=timezone.utc).timestamp()
+
+    with patch("coreason_budget.guard.time", wraps=time) as mock_time:
+        mock_time.time.return_value = mock_now
 
-        mgr = BudgetManager(config)
         user_id = "midnight_user"
         context = create_context(user_id)
 
-        await mgr.record_spend(context, 10.0)
-
-        keys = await fake_redis.keys(f"*user:{user_id}*")
-        ttl = await fake_redis.ttl(keys[0])
+        await manager.record_spend(context, 10.0)
 
-        assert 58 <= ttl <= 62
+    keys = await fake_redis.keys(f"*user:{user_id}*")
+    ttl = await fake_redis.ttl(keys[0])
 
-        await mgr.close()
+    assert keys == [f"budget:user:{user_id}:2023-10-27"]
+    assert 58 <= ttl <= 62
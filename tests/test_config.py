@@ -1,3 +1,6 @@
+from typing import Any
+
+import pytest
 from _pytest.monkeypatch import MonkeyPatch
 
 from coreason_budget.config import CoreasonBudgetConfig
@@ -9,6 +12,7 @@ def test_config_defaults() -> None:
     assert config.redis_url == "redis://localhost:6379"
     assert config.daily_user_limit_usd == 10.0
     assert config.daily_global_limit_usd == 5000.0
+    assert config.redis_max_connections == 32
 
 
 def test_config_overrides() -> None:
@@ -21,13 +25,21 @@ def test_config_overrides() -> None:
     assert config.model_price_overrides["gpt-4"]["input_cost_per_token"] == 0.01
 
 
-def test_config_env_vars(monkeypatch: MonkeyPatch) -> None:
-    monkeypatch.setenv("COREASON_BUDGET_REDIS_URL", "redis://env:6379")
-    monkeypatch.setenv("COREASON_BUDGET_DAILY_USER_LIMIT_USD", "25.0")
-
-    config = CoreasonBudgetConfig()
-    assert config.redis_url == "redis://env:6379"
-    assert config.daily_user_limit_usd == 25.0
+@pytest.mark.parametrize(
+    "env_key,attr,value",
+    [
+        ("COREASON_BUDGET_REDIS_URL", "redis_url", "redis://env:6379"),
+        ("COREASON_BUDGET_REDIS_MAX_CONNECTIONS", "redis_max_connections", 64),
+        ("COREASON_BUDGET_DAILY_GLOBAL_LIMIT_USD", "daily_global_limit_usd", 1234.5),
+        ("COREASON_BUDGET_DAILY_PROJECT_LIMIT_USD", "daily_project_limit_usd", 99.99),
+        ("COREASON_BUDGET_DAILY_USER_LIMIT_USD", "daily_user_limit_usd", 25.0),
+    ],
+)
+def test_config_env_vars(monkeypatch: MonkeyPatch, env_key: str, attr: str, value: Any) -> None:
+    monkeypatch.setenv("COREASON_BUDGET_REDIS_URL", "redis://default:6379")
+    monkeypatch.setenv(env_key, str(value))
+
+    assert getattr(CoreasonBudgetConfig(), attr) == value
 
 
 def test_config_alias() -> None:
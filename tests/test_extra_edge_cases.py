@@ -1,10 +1,10 @@
+from typing import Optional, cast
 from unittest.mock import patch
 
-import fakeredis.aioredis
+import fakeredis
 import pytest
 from coreason_identity.models import UserContext
 from redis.exceptions import ConnectionError as RedisPyConnectionError
-from redis.exceptions import RedisError
 
 from coreason_budget.config import CoreasonBudgetConfig
 from coreason_budget.exceptions import BudgetExceededError
@@ -24,38 +24,45 @@ def create_context(user_id: str) -> UserContext:
     return UserContext(user_id=user_id, email="test@example.com", groups=[], scopes=[], claims={})
 
 
-@pytest.mark.asyncio
-async def test_unicode_special_char_ids(config: CoreasonBudgetConfig) -> None:
-    fake_redis = fakeredis.aioredis.FakeRedis(decode_responses=True)
+@pytest.mark.parametrize(
+    "user_id,project_id,model",
+    [
+        ("user:name/with@special#chars & emoji 🚀", None, None),
+        ("user:123", "proj/sub", "gpt-4 (preview)"),
+        ("usér_👍", "proj_🚀", "m_€"),
+        ("用户 with spaces", "проект:1", "model\twith\ttabs"),
+    ],
+)
+async def test_unicode_special_char_ids(
+    config: CoreasonBudgetConfig,
+    user_id: str,
+    project_id: Optional[str],
+    model: Optional[str],
+    fake_redis: fakeredis.FakeAsyncRedis,
+) -> None:
     with (
-        patch("coreason_budget.ledger.from_url", return_value=fake_redis),
-        patch("coreason_budget.ledger.sync_from_url"),
+        patch("coreason_budget.ledger._async_client", return_value=fake_redis),
+        patch("coreason_budget.ledger.SyncRedis"),
     ):
         mgr = BudgetManager(config)
-
-        user_id = "user:name/with@special#chars & emoji 🚀"
         context = create_context(user_id)
 
-        assert await mgr.check_availability(context, estimated_cost=10.0) is True
-
-        await mgr.record_spend(context, 10.0)
+        assert await mgr.check_availability(context, project_id, estimated_cost=10.0) is True
 
-        keys = await fake_redis.keys("*")
-        matching_keys = [k for k in keys if user_id in k]
-        assert len(matching_keys) > 0
+        await mgr.record_spend(context, 10.0, project_id, model)
 
-        val = await fake_redis.get(matching_keys[0])
-        assert float(val) == 10.0
+        keys = mgr.guard._get_keys(user_id, project_id)
+        assert set(keys) == ({"global", "user", "project"} if project_id else {"global", "user"})
+        for key in keys.values():
+            assert float(cast(str, await fake_redis.get(key))) == 10.0
 
         await mgr.close()
 
 
-@pytest.mark.asyncio
-async def test_large_numbers(config: CoreasonBudgetConfig) -> None:
-    fake_redis = fakeredis.aioredis.FakeRedis(decode_responses=True)
+async def test_large_numbers(config: CoreasonBudgetConfig, fake_redis: fakeredis.FakeAsyncRedis) -> None:
     with (
-        patch("coreason_budget.ledger.from_url", return_value=fake_redis),
-        patch("coreason_budget.ledger.sync_from_url"),
+        patch("coreason_budget.ledger._async_client", return_value=fake_redis),
+        patch("coreason_budget.ledger.SyncRedis"),
     ):
         mgr = BudgetManager(config)
         user_id = "whale_user"
@@ -68,7 +75,7 @@ async def test_large_numbers(config: CoreasonBudgetConfig) -> None:
 
         keys = await fake_redis.keys(f"*user:{user_id}*")
         val = await fake_redis.get(keys[0])
-        assert float(val) == 2000.0
+        assert float(cast(str, val)) == 2000.0
 
         with pytest.raises(BudgetExceededError):
             await mgr.check_availability(context, estimated_cost=1.0)
@@ -76,19 +83,20 @@ async def test_large_numbers(config: CoreasonBudgetConfig) -> None:
         await mgr.close()
 
 
-@pytest.mark.asyncio
-async def test_redis_downtime_during_charge(config: CoreasonBudgetConfig) -> None:
-    fake_redis = fakeredis.aioredis.FakeRedis(decode_responses=True)
+async def test_redis_downtime_during_charge(
+    config: CoreasonBudgetConfig, fake_redis: fakeredis.FakeAsyncRedis, fake_server: fakeredis.FakeServer
+) -> None:
     with (
-        patch("coreason_budget.ledger.from_url", return_value=fake_redis),
-        patch("coreason_budget.ledger.sync_from_url"),
+        patch("coreason_budget.ledger._async_client", return_value=fake_redis),
+        patch("coreason_budget.ledger.SyncRedis"),
     ):
         mgr = BudgetManager(config)
         user_id = "unlucky_user"
         context = create_context(user_id)
 
-        with patch.object(mgr._async_ledger._redis, "eval", side_effect=RedisPyConnectionError("Connection lost")):
-            with pytest.raises(RedisError):
-                await mgr.record_spend(context, 10.0)
+        # `_clean_fake_server` reconnects the server after the test
+        fake_server.connected = False
+        with pytest.raises(RedisPyConnectionError):
+            await mgr.record_spend(context, 10.0)
 
         await mgr.close()
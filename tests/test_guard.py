@@ -1,3 +1,7 @@
+import re
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List
 from unittest.mock import AsyncMock, MagicMock
 
 import pytest
@@ -5,9 +9,18 @@ from coreason_identity.models import UserContext
 
 from coreason_budget.config import CoreasonBudgetConfig
 from coreason_budget.exceptions import BudgetExceededError
-from coreason_budget.guard import BudgetGuard, SyncBudgetGuard
+from coreason_budget.guard import BudgetGuard, Spend, SyncBudgetGuard
 from coreason_budget.ledger import RedisLedger, SyncRedisLedger
 
+_GLOBAL_RE = re.compile(r"Global daily limit exceeded")
+_PROJECT_RE = re.compile(r"Project daily limit exceeded")
+_USER_RE = re.compile(r"User daily limit exceeded")
+
+
+def usage_by_scope(usage: Dict[str, float]) -> Callable[[List[str]], List[float]]:
+    """Stand-in for get_usage_many: each key reads its scope's usage from the dict, 0.0 if absent."""
+    return lambda keys: [usage.get(key.split(":")[1], 0.0) for key in keys]
+
 
 @pytest.fixture
 def config() -> CoreasonBudgetConfig:
@@ -24,10 +37,9 @@ def user_context() -> UserContext:
     return UserContext(user_id="user1", email="user1@example.com", groups=[], scopes=[], claims={})
 
 
-@pytest.mark.asyncio
 async def test_guard_check_success(config: CoreasonBudgetConfig, user_context: UserContext) -> None:
-    ledger = MagicMock(spec=RedisLedger)
-    ledger.get_usage = AsyncMock(return_value=0.0)
+    ledger = AsyncMock(spec=RedisLedger)
+    ledger.get_usage_many.side_effect = usage_by_scope({})
 
     guard = BudgetGuard(config, ledger)
 
@@ -35,72 +47,135 @@ async def test_guard_check_success(config: CoreasonBudgetConfig, user_context: U
     result = await guard.check(user_context, "proj1", 5.0)
     assert result is True
 
-    # Verify calls
-    # Should check global, project, user
-    assert ledger.get_usage.call_count == 3
+    # Global, project and user are read in a single batched call, in check order
+    keys = guard._get_keys("user1", "proj1")
+    ledger.get_usage_many.assert_awaited_once_with([keys["global"], keys["project"], keys["user"]])
+    ledger.get_usage.assert_not_called()
+
+
+def test_guard_check_logs_at_debug(
+    config: CoreasonBudgetConfig, user_context: UserContext, log_sink: List[Dict[str, Any]]
+) -> None:
+    ledger = MagicMock(spec=SyncRedisLedger)
+    ledger.get_usage_many.side_effect = usage_by_scope({"global": 1.0, "user": 1.0})
+
+    SyncBudgetGuard(config, ledger).check(user_context, "proj1", 2.0)
+
+    record = log_sink[-1]
+    assert record["level"].name == "DEBUG"
+    assert record["message"] == (
+        "Budget Check Passed: User user1 | Estimated Cost: $2.0 | Global Used: $1.0 | User Used: $1.0"
+    )
 
 
-@pytest.mark.asyncio
 async def test_guard_check_global_limit(config: CoreasonBudgetConfig, user_context: UserContext) -> None:
-    ledger = MagicMock(spec=RedisLedger)
+    ledger = AsyncMock(spec=RedisLedger)
     # Global limit is 100. Return 99.
     # Estimated cost 2. Total 101 > 100.
-    ledger.get_usage = AsyncMock(return_value=99.0)
+    ledger.get_usage_many.side_effect = usage_by_scope({"global": 99.0})
 
     guard = BudgetGuard(config, ledger)
 
-    with pytest.raises(BudgetExceededError, match="Global daily limit exceeded"):
+    with pytest.raises(BudgetExceededError, match=_GLOBAL_RE):
         await guard.check(user_context, "proj1", 2.0)
 
 
-@pytest.mark.asyncio
 async def test_guard_check_project_limit(config: CoreasonBudgetConfig, user_context: UserContext) -> None:
-    ledger = MagicMock(spec=RedisLedger)
+    ledger = AsyncMock(spec=RedisLedger)
     # Global OK (0), Project limit 50. Return 49.
     # User OK (0).
-    # Need to mock sequence of returns: global, project, user
-    # Order in code: Global, Project, User
-    ledger.get_usage = AsyncMock(side_effect=[0.0, 49.0, 0.0])
+    ledger.get_usage_many.side_effect = usage_by_scope({"project": 49.0})
 
     guard = BudgetGuard(config, ledger)
 
-    with pytest.raises(BudgetExceededError, match="Project daily limit exceeded"):
+    with pytest.raises(BudgetExceededError, match=_PROJECT_RE):
         await guard.check(user_context, "proj1", 2.0)
 
 
-@pytest.mark.asyncio
 async def test_guard_check_user_limit(config: CoreasonBudgetConfig, user_context: UserContext) -> None:
-    ledger = MagicMock(spec=RedisLedger)
+    ledger = AsyncMock(spec=RedisLedger)
     # Global OK, Project OK, User limit 10. Return 9.
-    ledger.get_usage = AsyncMock(side_effect=[0.0, 0.0, 9.0])
+    ledger.get_usage_many.side_effect = usage_by_scope({"user": 9.0})
 
     guard = BudgetGuard(config, ledger)
 
-    with pytest.raises(BudgetExceededError, match="User daily limit exceeded"):
+    with pytest.raises(BudgetExceededError, match=_USER_RE):
         await guard.check(user_context, "proj1", 2.0)
 
 
-@pytest.mark.asyncio
 async def test_guard_charge(config: CoreasonBudgetConfig, user_context: UserContext) -> None:
-    ledger = MagicMock(spec=RedisLedger)
-    ledger.increment = AsyncMock()
+    ledger = AsyncMock(spec=RedisLedger)
 
     guard = BudgetGuard(config, ledger)
 
     await guard.charge(user_context, 5.0, "proj1")
 
-    assert ledger.increment.call_count == 3  # Global, Project, User
-    # Verify owner_id was passed
-    # Check last call args
-    call_args = ledger.increment.call_args
-    # call_args is (args, kwargs)
-    # increment(key, amount, owner_id=..., ttl=...)
-    assert call_args.kwargs["owner_id"] == "user1"
+    # All scopes go to the ledger in a single batched call
+    ledger.increment_many.assert_awaited_once()
+    (amounts,) = ledger.increment_many.call_args.args
+    assert amounts == dict.fromkeys(guard._get_keys("user1", "proj1").values(), 5.0)  # Global, User, Project
+    assert ledger.increment_many.call_args.kwargs["owner_id"] == "user1"
+    ledger.increment.assert_not_called()
+
+
+async def test_guard_charge_many_sums_shared_keys(config: CoreasonBudgetConfig, user_context: UserContext) -> None:
+    ledger = AsyncMock(spec=RedisLedger)
+    guard = BudgetGuard(config, ledger)
+    other = UserContext(user_id="user2", email="user2@example.com")
+
+    await guard.charge_many([Spend(user_context, 1.0, "proj1"), Spend(other, 2.0, "proj1"), Spend(user_context, 0.5)])
+
+    keys = guard._get_keys("user1", "proj1")
+    (amounts,) = ledger.increment_many.call_args.args
+    assert amounts == {
+        keys["global"]: 3.5,
+        keys["user"]: 1.5,
+        keys["project"]: 3.0,
+        guard._get_keys("user2")["user"]: 2.0,
+    }
+    assert ledger.increment_many.call_args.kwargs["owner_id"] == "user1,user2"
+
+
+@pytest.mark.parametrize("scope,pattern", [("global", _GLOBAL_RE), ("project", _PROJECT_RE), ("user", _USER_RE)])
+async def test_guard_check_and_charge_exceeded(
+    config: CoreasonBudgetConfig, user_context: UserContext, scope: str, pattern: re.Pattern[str]
+) -> None:
+    ledger = AsyncMock(spec=RedisLedger)
+    guard = BudgetGuard(config, ledger)
+    keys = guard._get_keys("user1", "proj1")
+    ledger.increment_within_limits.return_value = (keys[scope], 9.5)
+
+    with pytest.raises(BudgetExceededError, match=pattern):
+        await guard.check_and_charge(user_context, 2.0, "proj1")
+
+    # Limits go to the ledger in check order
+    (limits, amount) = ledger.increment_within_limits.call_args.args
+    assert limits == {keys["global"]: 100.0, keys["project"]: 50.0, keys["user"]: 10.0}
+    assert list(limits) == [keys["global"], keys["project"], keys["user"]]
+    assert amount == 2.0
+
+
+def test_sync_guard_check_and_charge(
+    config: CoreasonBudgetConfig, user_context: UserContext, log_sink: List[Dict[str, Any]]
+) -> None:
+    ledger = MagicMock(spec=SyncRedisLedger)
+    guard = SyncBudgetGuard(config, ledger)
+    ledger.increment_within_limits.return_value = None
+
+    guard.check_and_charge(user_context, 2.0, model="gpt-4")
+
+    keys = guard._get_keys("user1")
+    assert ledger.increment_within_limits.call_args.args == ({keys["global"]: 100.0, keys["user"]: 10.0}, 2.0)
+    assert log_sink[-1]["message"] == "Recorded Spend: User user1 | Cost: $2.0 | Project: None | Model: gpt-4"
+
+    ledger.increment_within_limits.return_value = (keys["user"], 9.0)
+    with pytest.raises(BudgetExceededError, match=_USER_RE):
+        guard.check_and_charge(user_context, 2.0)
 
 
 def test_sync_guard_check_success(config: CoreasonBudgetConfig, user_context: UserContext) -> None:
     ledger = MagicMock(spec=SyncRedisLedger)
-    ledger.get_usage.return_value = 0.0
+    ledger.get_usage_many.side_effect = usage_by_scope({})
 
     guard = SyncBudgetGuard(config, ledger)
 
@@ -112,8 +187,8 @@ def test_sync_guard_check_user_limits(config: CoreasonBudgetConfig, user_context
     guard = SyncBudgetGuard(config, ledger)
 
     # User limit
-    ledger.get_usage.side_effect = [0.0, 0.0, 9.0]
-    with pytest.raises(BudgetExceededError, match="User daily limit exceeded"):
+    ledger.get_usage_many.side_effect = usage_by_scope({"user": 9.0})
+    with pytest.raises(BudgetExceededError, match=_USER_RE):
         guard.check(user_context, "proj1", 2.0)
 
 
@@ -122,8 +197,8 @@ def test_sync_guard_check_global_limit(config: CoreasonBudgetConfig, user_contex
     guard = SyncBudgetGuard(config, ledger)
 
     # Global limit exceeded
-    ledger.get_usage.side_effect = [99.0]
-    with pytest.raises(BudgetExceededError, match="Global daily limit exceeded"):
+    ledger.get_usage_many.side_effect = usage_by_scope({"global": 99.0})
+    with pytest.raises(BudgetExceededError, match=_GLOBAL_RE):
         guard.check(user_context, "proj1", 2.0)
 
 
@@ -132,8 +207,8 @@ def test_sync_guard_check_project_limit(config: CoreasonBudgetConfig, user_conte
     guard = SyncBudgetGuard(config, ledger)
 
     # Project limit exceeded
-    ledger.get_usage.side_effect = [0.0, 49.0]
-    with pytest.raises(BudgetExceededError, match="Project daily limit exceeded"):
+    ledger.get_usage_many.side_effect = usage_by_scope({"project": 49.0})
+    with pytest.raises(BudgetExceededError, match=_PROJECT_RE):
         guard.check(user_context, "proj1", 2.0)
 
 
@@ -143,5 +218,72 @@ def test_sync_guard_charge(config: CoreasonBudgetConfig, user_context: UserConte
 
     guard.charge(user_context, 5.0, "proj1")
 
-    assert ledger.increment.call_count == 3
-    assert ledger.increment.call_args.kwargs["owner_id"] == "user1"
+    ledger.increment_many.assert_called_once()
+    assert set(ledger.increment_many.call_args.args[0].values()) == {5.0}
+    assert len(ledger.increment_many.call_args.args[0]) == 3
+    assert ledger.increment_many.call_args.kwargs["owner_id"] == "user1"
+
+
+def test_get_keys_project_scope_is_optional(config: CoreasonBudgetConfig) -> None:
+    guard = BudgetGuard(config, AsyncMock(spec=RedisLedger))
+
+    assert set(guard._get_keys("u1", "p1")) == {"global", "project", "user"}
+    assert set(guard._get_keys("u1", None)) == {"global", "user"}
+
+
+async def test_guard_check_without_project(config: CoreasonBudgetConfig, user_context: UserContext) -> None:
+    ledger = AsyncMock(spec=RedisLedger)
+    ledger.get_usage_many.side_effect = usage_by_scope({})
+
+    guard = BudgetGuard(config, ledger)
+
+    assert await guard.check(user_context, None, 5.0) is True
+    # Global and user only; no project lookup
+    assert len(ledger.get_usage_many.call_args.args[0]) == 2
+
+
+async def test_guard_runtime_limit_update(config: CoreasonBudgetConfig, user_context: UserContext) -> None:
+    ledger = AsyncMock(spec=RedisLedger)
+    ledger.get_usage_many.side_effect = usage_by_scope({"user": 9.0})
+
+    guard = BudgetGuard(config, ledger)
+
+    with pytest.raises(BudgetExceededError, match=_USER_RE):
+        await guard.check(user_context, "proj1", 2.0)
+
+    config.daily_user_limit_usd = 20.0
+    assert await guard.check(user_context, "proj1", 2.0) is True
+
+    config.daily_user_limit_usd = 5.0
+    with pytest.raises(BudgetExceededError, match=_USER_RE):
+        await guard.check(user_context, "proj1", 2.0)
+
+
+async def test_guard_config_replacement(config: CoreasonBudgetConfig, user_context: UserContext) -> None:
+    ledger = AsyncMock(spec=RedisLedger)
+    ledger.get_usage_many.side_effect = usage_by_scope({"user": 9.0})
+
+    guard = BudgetGuard(config, ledger)
+    with pytest.raises(BudgetExceededError, match=_USER_RE):
+        await guard.check(user_context, "proj1", 2.0)
+
+    # Swapping in a different config takes effect on the next check
+    guard.config = config.model_copy(update={"daily_user_limit_usd": 20.0})
+    assert await guard.check(user_context, "proj1", 2.0) is True
+
+
+def test_date_str_follows_utc_day(config: CoreasonBudgetConfig, monkeypatch: pytest.MonkeyPatch) -> None:
+    mock_time = MagicMock(wraps=time)
+    mock_time.time.return_value = datetime(2025, 1, 1, 23, 59, 30, tzinfo=timezone.utc).timestamp()
+    monkeypatch.setattr("coreason_budget.guard.time", mock_time)
+    guard = SyncBudgetGuard(config, MagicMock(spec=SyncRedisLedger))
+
+    assert guard._get_date_str() == "2025-01-01"
+    assert guard._get_date_str() == "2025-01-01"
+    assert guard._calculate_ttl() == 30
+    # Formatted once for the day, not on every call
+    assert mock_time.strftime.call_count == 1
+
+    mock_time.time.return_value += 31
+    assert guard._get_date_str() == "2025-01-02"
+    assert guard._calculate_ttl() == 86399
@@ -1,134 +1,335 @@
-from unittest.mock import MagicMock, patch
+import asyncio
+import inspect
+import re
+from typing import Any, AsyncGenerator, Dict, Generator, List, Union, cast
+from unittest.mock import AsyncMock, MagicMock
 
 import fakeredis
-import fakeredis.aioredis
 import pytest
+import pytest_asyncio
+from fakeredis import aioredis
+from redis import BlockingConnectionPool as SyncBlockingConnectionPool
+from redis import Redis as SyncRedis
+from redis.asyncio import BlockingConnectionPool
 from redis.exceptions import ConnectionError as RedisPyConnectionError
-from redis.exceptions import RedisError
+from redis.exceptions import RedisError, ResponseError
+from redis.utils import HIREDIS_AVAILABLE
 
 from coreason_budget.exceptions import RedisConnectionError
-from coreason_budget.ledger import RedisLedger, SyncRedisLedger
+from coreason_budget.ledger import (
+    LUA_INCREMENT_MANY_SHA,
+    LUA_INCREMENT_SHA,
+    LUA_INCREMENT_WITHIN_LIMITS_SHA,
+    POOL_TIMEOUT_SECONDS,
+    RedisLedger,
+    SyncRedisLedger,
+    disconnect_sync_pools,
+)
 
+AnyLedger = Union[RedisLedger, SyncRedisLedger]
 
-@pytest.mark.asyncio
-async def test_async_ledger_increment_and_expiry() -> None:
-    fake_redis = fakeredis.aioredis.FakeRedis(decode_responses=True)
+_CONNECT_RE = re.compile(r"Could not connect to Redis: Connection refused")
+_NOT_FLOAT_RE = re.compile(r"value is not a valid float: test:budget:corrupt")
 
-    with patch("coreason_budget.ledger.from_url", return_value=fake_redis):
-        ledger = RedisLedger("redis://localhost")
-        await ledger.connect()
 
-        key = "test:budget:1"
-        amount = 10.5
-        ttl = 3600
+async def resolve(value: Any) -> Any:
+    """Await results from the async ledger/client; pass sync results through."""
+    return await value if inspect.isawaitable(value) else value
 
-        new_val = await ledger.increment(key, amount, owner_id="test_owner", ttl=ttl)
-        assert new_val == 10.5
 
-        val = await fake_redis.get(key)
-        assert float(val) == 10.5
+@pytest.fixture(autouse=True)
+def _drop_sync_pools() -> Generator[None, None, None]:
+    # Sync ledgers register process-wide pools; drop them so they do not outlive the test
+    yield
+    disconnect_sync_pools()
 
-        actual_ttl = await fake_redis.ttl(key)
-        assert 0 < actual_ttl <= 3600
 
-        await fake_redis.expire(key, 100)
-        await ledger.increment(key, 5.0, owner_id="test_owner", ttl=3600)
+@pytest_asyncio.fixture(params=["async", "sync"])
+async def any_ledger(
+    request: pytest.FixtureRequest,
+    ledger: RedisLedger,
+    fake_server: fakeredis.FakeServer,
+    monkeypatch: pytest.MonkeyPatch,
+) -> AsyncGenerator[AnyLedger, None]:
+    if request.param == "async":
+        yield ledger
+        return
 
-        current_val = await fake_redis.get(key)
-        assert float(current_val) == 15.5
+    sync_redis = fakeredis.FakeRedis(server=fake_server)
+    monkeypatch.setattr("coreason_budget.ledger.SyncRedis", lambda *a, **k: sync_redis)
+    sync_ledger = SyncRedisLedger("redis://localhost")
+    yield sync_ledger
+    sync_ledger.close()
 
-        current_ttl = await fake_redis.ttl(key)
-        assert current_ttl <= 100
 
-        usage = await ledger.get_usage(key)
-        assert usage == 15.5
+async def test_ledger_increment_and_expiry(any_ledger: AnyLedger) -> None:
+    fake_redis = any_ledger._redis
+    await resolve(any_ledger.connect())
 
-        usage = await ledger.get_usage("missing")
-        assert usage == 0.0
+    key = "test:budget:1"
+    amount = 10.5
+    ttl = 3600
 
-        await ledger.close()
+    # Empty script cache: the first increment must load the script before EVALSHA succeeds
+    await resolve(fake_redis.script_flush())
 
+    new_val = await resolve(any_ledger.increment(key, amount, owner_id="test_owner", ttl=ttl))
+    assert new_val == 10.5
 
-def test_sync_ledger_increment_and_expiry() -> None:
-    fake_redis = fakeredis.FakeRedis(decode_responses=True)
+    # Read the value and TTL back in one round-trip
+    pipe = fake_redis.pipeline(transaction=False)
+    pipe.get(key)
+    pipe.ttl(key)
+    val, actual_ttl = await resolve(pipe.execute())
+    assert float(val) == 10.5
+    assert 0 < actual_ttl <= 3600
 
-    with patch("coreason_budget.ledger.sync_from_url", return_value=fake_redis):
-        ledger = SyncRedisLedger("redis://localhost")
-        ledger.connect()
+    # Existing TTL is preserved on subsequent increments
+    await resolve(fake_redis.expire(key, 100))
+    new_val = await resolve(any_ledger.increment(key, 5.0, owner_id="test_owner", ttl=3600))
+    assert new_val == 15.5
 
-        key = "test:budget:sync:1"
-        amount = 20.0
-        ttl = 60
+    current_ttl = await resolve(fake_redis.ttl(key))
+    assert current_ttl <= 100
 
-        new_val = ledger.increment(key, amount, owner_id="test_owner", ttl=ttl)
-        assert new_val == 20.0
+    usage = await resolve(any_ledger.get_usage(key))
+    assert usage == 15.5
 
-        assert float(fake_redis.get(key)) == 20.0
-        assert 0 < fake_redis.ttl(key) <= 60
+    usage = await resolve(any_ledger.get_usage("missing"))
+    assert usage == 0.0
 
-        new_val = ledger.increment(key, 10.0, owner_id="test_owner", ttl=60)
-        assert new_val == 30.0
 
-        usage = ledger.get_usage(key)
-        assert usage == 30.0
+async def test_ledger_connect_loads_scripts(any_ledger: AnyLedger) -> None:
+    fake_redis = any_ledger._redis
+    shas = [LUA_INCREMENT_SHA, LUA_INCREMENT_MANY_SHA, LUA_INCREMENT_WITHIN_LIMITS_SHA]
+    await resolve(fake_redis.script_flush())
 
-        ledger.close()
+    await resolve(any_ledger.connect())
 
+    # Every script is cached server-side before the first spend arrives
+    assert await resolve(fake_redis.script_exists(*shas)) == [True, True, True]
 
-@pytest.mark.asyncio
-async def test_ledger_connection_error() -> None:
-    with patch("coreason_budget.ledger.from_url") as mock_from_url:
-        mock_redis = MagicMock()
-        mock_redis.ping.side_effect = RedisPyConnectionError("Connection refused")
-        mock_from_url.return_value = mock_redis
 
-        ledger = RedisLedger("redis://bad-url")
+async def test_ledger_increment_many(any_ledger: AnyLedger) -> None:
+    fake_redis = any_ledger._redis
+    keys = ["test:budget:global", "test:budget:user"]
 
-        with pytest.raises(RedisConnectionError, match="Could not connect to Redis"):
-            await ledger.connect()
+    # Start with an empty script cache: the first batch must load the script and replay
+    await resolve(fake_redis.script_flush())
+    amounts = {keys[0]: 2.5, keys[1]: 1.5}
+    assert await resolve(any_ledger.increment_many(amounts, owner_id="test_owner", ttl=3600)) == [2.5, 1.5]
+    assert await resolve(fake_redis.script_exists(LUA_INCREMENT_MANY_SHA)) == [True]
 
+    await resolve(fake_redis.expire(keys[0], 100))
+    assert await resolve(any_ledger.increment_many(dict.fromkeys(keys, 1.0), owner_id="test_owner", ttl=3600)) == [
+        3.5,
+        2.5,
+    ]
+    assert await resolve(fake_redis.ttl(keys[0])) <= 100
+    assert 100 < await resolve(fake_redis.ttl(keys[1])) <= 3600
 
-@pytest.mark.asyncio
-async def test_ledger_get_error() -> None:
-    with patch("coreason_budget.ledger.from_url") as mock_from_url:
-        mock_redis = MagicMock()
-        mock_redis.get.side_effect = RedisError("Read failed")
-        mock_from_url.return_value = mock_redis
+    # One MGET reads them back; missing keys count as zero spend
+    assert await resolve(any_ledger.get_usage_many([*keys, "missing"])) == [3.5, 2.5, 0.0]
 
-        ledger = RedisLedger("redis://localhost")
 
-        with pytest.raises(RedisError):
-            await ledger.get_usage("some-key")
+async def test_ledger_increment_many_is_all_or_nothing(any_ledger: AnyLedger) -> None:
+    fake_redis = any_ledger._redis
+    await resolve(fake_redis.set("test:budget:ok", 1.0))
+    await resolve(fake_redis.set("test:budget:corrupt", "not-a-number"))
+    amounts = {"test:budget:ok": 1.0, "test:budget:corrupt": 1.0, "test:budget:new": 1.0}
 
+    with pytest.raises(ResponseError, match=_NOT_FLOAT_RE):
+        await resolve(any_ledger.increment_many(amounts, owner_id="test_owner", ttl=60))
 
-@pytest.mark.asyncio
-async def test_ledger_increment_error() -> None:
-    with patch("coreason_budget.ledger.from_url") as mock_from_url:
-        mock_redis = MagicMock()
-        mock_redis.eval.side_effect = RedisError("Eval failed")
-        mock_from_url.return_value = mock_redis
+    # Neither the key before nor the key after the bad one was written
+    assert await resolve(any_ledger.get_usage_many(["test:budget:ok", "test:budget:new"])) == [1.0, 0.0]
 
-        ledger = RedisLedger("redis://localhost")
 
-        with pytest.raises(RedisError):
-            await ledger.increment("some-key", 10.0, owner_id="test_owner")
+async def test_ledger_increment_within_limits(any_ledger: AnyLedger) -> None:
+    fake_redis = any_ledger._redis
+    limits = {"test:budget:global": 10.0, "test:budget:user": 2.0}
 
+    await resolve(fake_redis.script_flush())
+    assert await resolve(any_ledger.increment_within_limits(limits, 1.5, owner_id="test_owner", ttl=3600)) is None
+    assert await resolve(any_ledger.get_usage_many(list(limits))) == [1.5, 1.5]
+    assert 0 < await resolve(fake_redis.ttl("test:budget:user")) <= 3600
 
-def test_sync_ledger_errors() -> None:
-    with patch("coreason_budget.ledger.sync_from_url") as mock_from_url:
-        mock_redis = MagicMock()
-        mock_from_url.return_value = mock_redis
+    # The user key would pass its limit: it is reported and neither key is written
+    exceeded = await resolve(any_ledger.increment_within_limits(limits, 1.0, owner_id="test_owner", ttl=3600))
+    assert exceeded == ("test:budget:user", 1.5)
+    assert await resolve(any_ledger.get_usage_many(list(limits))) == [1.5, 1.5]
 
-        ledger = SyncRedisLedger("redis://localhost")
+    # Landing exactly on a limit is allowed
+    assert await resolve(any_ledger.increment_within_limits(limits, 0.5, owner_id="test_owner")) is None
+    assert await resolve(any_ledger.get_usage_many(list(limits))) == [2.0, 2.0]
 
-        mock_redis.ping.side_effect = RedisPyConnectionError("Connection refused")
-        with pytest.raises(RedisConnectionError):
-            ledger.connect()
+    await resolve(fake_redis.set("test:budget:corrupt", "not-a-number"))
+    with pytest.raises(ResponseError, match=_NOT_FLOAT_RE):
+        await resolve(
+            any_ledger.increment_within_limits({**limits, "test:budget:corrupt": 5.0}, 0.0, owner_id="test_owner")
+        )
 
-        mock_redis.get.side_effect = RedisError("Read failed")
-        with pytest.raises(RedisError):
-            ledger.get_usage("some-key")
 
-        mock_redis.eval.side_effect = RedisError("Eval failed")
-        with pytest.raises(RedisError):
-            ledger.increment("some-key", 10.0, owner_id="test_owner")
+async def test_ledger_batch_errors(
+    any_ledger: AnyLedger, fake_server: fakeredis.FakeServer, log_sink: List[Dict[str, Any]]
+) -> None:
+    fake_server.connected = False
+
+    with pytest.raises(RedisPyConnectionError):
+        await resolve(any_ledger.get_usage_many(["some-key"]))
+    assert log_sink[-1]["level"].name == "ERROR"
+    assert log_sink[-1]["message"].startswith("Redis MGET error for keys ['some-key']")
+
+    with pytest.raises(RedisPyConnectionError):
+        await resolve(any_ledger.increment_many({"some-key": 1.0}, owner_id="test_owner"))
+    assert log_sink[-1]["level"].name == "ERROR"
+    assert log_sink[-1]["message"].startswith("Redis INCRBYFLOAT error for keys ['some-key'] (owner: test_owner)")
+
+    with pytest.raises(RedisPyConnectionError):
+        await resolve(any_ledger.increment_within_limits({"some-key": 1.0}, 1.0, owner_id="test_owner"))
+    assert log_sink[-1]["message"].startswith("Redis INCRBYFLOAT error for keys ['some-key'] (owner: test_owner)")
+
+
+@pytest.mark.parametrize("mode", ["async", "sync"])
+@pytest.mark.parametrize("exc_type", [RedisPyConnectionError, RedisError, OSError])
+async def test_ledger_connection_error(mode: str, exc_type: type[Exception], monkeypatch: pytest.MonkeyPatch) -> None:
+    # redis-py declares the async client's commands as plain defs, so a spec would hand back sync mocks
+    mock_redis = AsyncMock() if mode == "async" else MagicMock(spec=SyncRedis)
+    mock_redis.ping = (AsyncMock if mode == "async" else MagicMock)(side_effect=exc_type("Connection refused"))
+    factory = "_async_client" if mode == "async" else "SyncRedis"
+    monkeypatch.setattr(f"coreason_budget.ledger.{factory}", lambda *a, **k: mock_redis)
+
+    ledger: AnyLedger = RedisLedger("redis://bad-url") if mode == "async" else SyncRedisLedger("redis://bad-url")
+
+    with pytest.raises(RedisConnectionError, match=_CONNECT_RE):
+        await resolve(ledger.connect())
+
+
+async def test_ledger_close(monkeypatch: pytest.MonkeyPatch) -> None:
+    mock_redis = AsyncMock()
+    mock_sync_redis = MagicMock()
+    monkeypatch.setattr("coreason_budget.ledger._async_client", lambda *a, **k: mock_redis)
+    monkeypatch.setattr("coreason_budget.ledger.SyncRedis", lambda *a, **k: mock_sync_redis)
+
+    await RedisLedger("redis://localhost").close()
+    SyncRedisLedger("redis://localhost").close()
+
+    mock_redis.aclose.assert_awaited_once()
+    mock_sync_redis.close.assert_called_once()
+
+
+async def test_ledger_get_error(monkeypatch: pytest.MonkeyPatch, log_sink: List[Dict[str, Any]]) -> None:
+    mock_redis = AsyncMock()
+    mock_redis.get = AsyncMock(side_effect=RedisError("Read failed"))
+    monkeypatch.setattr("coreason_budget.ledger._async_client", lambda *a, **k: mock_redis)
+
+    ledger = RedisLedger("redis://localhost")
+
+    with pytest.raises(RedisError):
+        await ledger.get_usage("some-key")
+    mock_redis.get.assert_awaited_once()
+
+    assert log_sink[-1]["level"].name == "ERROR"
+    assert log_sink[-1]["message"] == "Redis GET error for key some-key: Read failed"
+
+
+async def test_ledger_increment_error(monkeypatch: pytest.MonkeyPatch) -> None:
+    mock_redis = AsyncMock()
+    mock_redis.evalsha = AsyncMock(side_effect=RedisError("Evalsha failed"))
+    monkeypatch.setattr("coreason_budget.ledger._async_client", lambda *a, **k: mock_redis)
+
+    ledger = RedisLedger("redis://localhost")
+
+    with pytest.raises(RedisError):
+        await ledger.increment("some-key", 10.0, owner_id="test_owner")
+    mock_redis.evalsha.assert_awaited_once()
+
+
+def test_sync_ledger_errors(monkeypatch: pytest.MonkeyPatch) -> None:
+    mock_redis = MagicMock(spec=SyncRedis)
+    monkeypatch.setattr("coreason_budget.ledger.SyncRedis", lambda *a, **k: mock_redis)
+
+    ledger = SyncRedisLedger("redis://localhost")
+
+    mock_redis.get.side_effect = RedisError("Read failed")
+    with pytest.raises(RedisError):
+        ledger.get_usage("some-key")
+
+    mock_redis.evalsha.side_effect = RedisError("Evalsha failed")
+    with pytest.raises(RedisError):
+        ledger.increment("some-key", 10.0, owner_id="test_owner")
+
+
+async def test_ledger_rejects_unencodable_key(ledger: RedisLedger, fake_redis: fakeredis.FakeAsyncRedis) -> None:
+    # Keys go through redis-py's strict UTF-8 encoder, so an ID with a lone surrogate is refused, not written
+    key = "budget:user:bad\udcff:2025-01-01"
+
+    with pytest.raises(UnicodeEncodeError):
+        await ledger.increment(key, 2.5, owner_id="test_owner", ttl=60)
+    assert await fake_redis.keys("budget:user:bad*") == []
+
+
+def test_ledger_connection_pool_options() -> None:
+    async_pool = RedisLedger("redis://localhost", max_connections=8)._redis.connection_pool
+    sync_pool = SyncRedisLedger("redis://localhost")._redis.connection_pool
+
+    for pool, max_connections in ((async_pool, 8), (sync_pool, 32)):
+        # Blocking pools make a burst past max_connections wait for a connection instead of failing
+        assert isinstance(pool, (BlockingConnectionPool, SyncBlockingConnectionPool))
+        assert pool.max_connections == max_connections
+        assert pool.timeout == POOL_TIMEOUT_SECONDS
+        assert pool.connection_kwargs["socket_keepalive"] is True
+        assert pool.connection_kwargs["socket_keepalive_options"]
+        assert pool.connection_kwargs["health_check_interval"] == 30
+        assert "decode_responses" not in pool.connection_kwargs
+
+
+async def test_ledger_waits_for_a_free_connection(fake_server: fakeredis.FakeServer) -> None:
+    ledger = RedisLedger("redis://localhost", max_connections=1)
+    pool = ledger._redis.connection_pool
+    # Real blocking pool, fake connections; fakeredis does not answer redis-py's PING health check
+    pool.connection_class = aioredis.FakeAsyncRedisConnection
+    pool.connection_kwargs.update(server=fake_server, health_check_interval=0)
+
+    # The pool's only connection is busy; the command queues until it is released rather than erroring
+    held = await cast(Any, pool).get_connection()
+    asyncio.get_running_loop().call_later(0.01, lambda: asyncio.ensure_future(pool.release(held)))
+    assert await ledger.increment("test:budget:wait", 1.0, owner_id="test_owner") == 1.0
+    await ledger.close()
+
+
+def test_sync_ledgers_share_pool(monkeypatch: pytest.MonkeyPatch) -> None:
+    first = SyncRedisLedger("redis://pool-test")
+    second = SyncRedisLedger("redis://pool-test")
+    pool = first._redis.connection_pool
+
+    assert second._redis.connection_pool is pool
+    other = SyncRedisLedger("redis://pool-test", max_connections=4)
+    assert other._redis.connection_pool is not pool
+
+    # Closing one ledger, even twice, leaves the shared pool connected for the other
+    mock_disconnect = MagicMock()
+    monkeypatch.setattr(pool, "disconnect", mock_disconnect)
+    first.close()
+    first.close()
+    mock_disconnect.assert_not_called()
+
+    # The last ledger out disconnects it, and the next ledger gets a fresh pool
+    second.close()
+    mock_disconnect.assert_called_once()
+    assert SyncRedisLedger("redis://pool-test")._redis.connection_pool is not pool
+
+    # A pool torn down early is not released again, nor is the newer pool that replaced it
+    replacement = SyncRedisLedger("redis://pool-test", max_connections=4)
+    disconnect_sync_pools()
+    newer = SyncRedisLedger("redis://pool-test", max_connections=4)
+    other.close()
+    replacement.close()
+    assert (
+        SyncRedisLedger("redis://pool-test", max_connections=4)._redis.connection_pool is newer._redis.connection_pool
+    )
+
+
+def test_ledger_uses_hiredis_parser() -> None:
+    # redis-py picks the hiredis parser for every new connection whenever hiredis is importable
+    assert HIREDIS_AVAILABLE
@@ -1,40 +1,51 @@
-import os
-from unittest.mock import patch
+from pathlib import Path
+from typing import Any, Dict, Generator, List, Optional
+from unittest.mock import ANY, patch
 
 import pytest
 
-
-def test_logger_path_env_var(monkeypatch: pytest.MonkeyPatch) -> None:
-    # We need to reload the module to test side effects of import
-    # But reloading loguru logger setup is tricky because it's global state.
-    # However, we can just verify the logic by importing it in a subprocess or
-    # just trusting the code since it's simple.
-    # But requirement says "Add a test case".
-    # Since the module code runs on import, we can't easily test it in the same process
-    # if it's already imported.
-    # We can use `importlib.reload` but `logger.add` adds handlers cumulatively.
-    # We should probably mock `logger.add` and `os.makedirs`.
-
-    with (
-        patch.dict(os.environ, {"COREASON_BUDGET_LOG_PATH": "custom/logs/test.log"}),
-        patch("coreason_budget.utils.logger.logger.add") as mock_add,
-        patch("os.makedirs") as mock_makedirs,
-        patch("sys.stderr"),
-    ):
-        # We need to reload the module
-        import importlib
-
-        import coreason_budget.utils.logger
-
-        importlib.reload(coreason_budget.utils.logger)
-
-        # Verify makedirs called with custom path dir
-        mock_makedirs.assert_called_with("custom/logs", exist_ok=True)
-
-        # Verify logger.add called with custom path
-        # Note: logger.add is called twice (console and file)
-        # Check calls
-        calls = mock_add.call_args_list
-        # Found file handler call
-        file_call = next((call for call in calls if "custom/logs/test.log" in str(call)), None)
-        assert file_call is not None
+from coreason_budget.utils.logger import _configure, logger
+
+
+def test_logger_writes_to_sink(log_sink: List[Dict[str, Any]]) -> None:
+    logger.info("Test log entry")
+    logger.debug("Debug detail")
+
+    assert [(r["level"].name, r["message"]) for r in log_sink] == [
+        ("INFO", "Test log entry"),
+        ("DEBUG", "Debug detail"),
+    ]
+
+
+@pytest.fixture
+def restore_logger() -> Generator[None, None, None]:
+    yield
+    _configure()
+
+
+@pytest.mark.parametrize(
+    "env,log_path,expected_path",
+    [
+        ({}, None, "logs/app.log"),
+        ({"COREASON_BUDGET_LOG_PATH": "custom/logs/test.log"}, None, "custom/logs/test.log"),
+        ({"COREASON_BUDGET_LOG_PATH": "custom/logs/test.log"}, "explicit/logs/test.log", "explicit/logs/test.log"),
+    ],
+)
+def test_logger_dir_creation(
+    restore_logger: None,
+    env: Dict[str, str],
+    log_path: Optional[str],
+    expected_path: str,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv("COREASON_BUDGET_LOG_PATH", raising=False)
+    for key, value in env.items():
+        monkeypatch.setenv(key, value)
+
+    with patch("coreason_budget.utils.logger.logger.add") as mock_add:
+        _configure(log_path)
+
+    assert (tmp_path / expected_path).parent.is_dir()
+    mock_add.assert_any_call(expected_path, rotation=ANY, retention=ANY, level=ANY, serialize=True)
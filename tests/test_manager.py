@@ -1,7 +1,10 @@
+from typing import Optional
 from unittest.mock import AsyncMock, MagicMock, patch
 
+import litellm
 import pytest
 from coreason_identity.models import UserContext
+from redis import Redis as SyncRedis
 
 from coreason_budget.config import CoreasonBudgetConfig
 from coreason_budget.manager import BudgetManager
@@ -17,15 +20,17 @@ def user_context() -> UserContext:
     return UserContext(user_id="user1", email="user1@example.com", groups=[], scopes=[], claims={})
 
 
-@pytest.mark.asyncio
-async def test_manager_async_flow(config: CoreasonBudgetConfig, user_context: UserContext) -> None:
+@pytest.mark.parametrize("model", [None, "gpt-4"], ids=["without_model", "with_model"])
+async def test_manager_async_flow(
+    config: CoreasonBudgetConfig, user_context: UserContext, model: Optional[str]
+) -> None:
     # Mock at the Redis level
-    with patch("coreason_budget.ledger.from_url") as mock_async_redis, patch("coreason_budget.ledger.sync_from_url"):
+    with patch("coreason_budget.ledger._async_client") as mock_async_redis, patch("coreason_budget.ledger.SyncRedis"):
         # Setup mocks
         mock_async = AsyncMock()
         mock_async_redis.return_value = mock_async
-        # get returning 0.0
-        mock_async.get.return_value = "0.0"
+        # Every scope reads 0.0 from the single MGET
+        mock_async.mget.return_value = ["0.0", "0.0", "0.0"]
 
         mgr = BudgetManager(config)
 
@@ -33,43 +38,46 @@ async def test_manager_async_flow(config: CoreasonBudgetConfig, user_context: Us
         available = await mgr.check_availability(user_context, "proj1", 0.5)
         assert available is True
 
-        # Charge
-        mock_async.eval.return_value = "1.0"
-        await mgr.record_spend(user_context, 0.5, "proj1")
+        # Charge: every scope is written by one script call
+        mock_async.evalsha.return_value = ["1.0", "1.0", "1.0"]
+        await mgr.record_spend(user_context, 0.5, "proj1", model)
 
         # Verify calls
-        assert mock_async.get.call_count >= 1
-        assert mock_async.eval.call_count >= 1
+        mock_async.mget.assert_awaited_once()
+        mock_async.evalsha.assert_awaited_once()
+        assert mock_async.evalsha.call_args.args[1] == 3  # numkeys
 
         await mgr.close()
 
 
-def test_manager_sync_flow(config: CoreasonBudgetConfig, user_context: UserContext) -> None:
-    with patch("coreason_budget.ledger.from_url"), patch("coreason_budget.ledger.sync_from_url") as mock_sync_redis:
-        mock_sync = MagicMock()
+@pytest.mark.parametrize("model", [None, "gpt-4"], ids=["without_model", "with_model"])
+def test_manager_sync_flow(config: CoreasonBudgetConfig, user_context: UserContext, model: Optional[str]) -> None:
+    with patch("coreason_budget.ledger._async_client"), patch("coreason_budget.ledger.SyncRedis") as mock_sync_redis:
+        mock_sync = MagicMock(spec=SyncRedis)
         mock_sync_redis.return_value = mock_sync
-        mock_sync.get.return_value = "0.0"
-        mock_sync.eval.return_value = "1.0"
+        mock_sync.mget.return_value = ["0.0", "0.0", "0.0"]
+        mock_sync.evalsha.return_value = ["1.0", "1.0", "1.0"]
 
         mgr = BudgetManager(config)
 
         available = mgr.check_availability_sync(user_context, "proj1", 0.5)
         assert available is True
 
-        mgr.record_spend_sync(user_context, 0.5, "proj1")
+        mgr.record_spend_sync(user_context, 0.5, "proj1", model)
 
-        assert mock_sync.get.call_count >= 1
-        assert mock_sync.eval.call_count >= 1
+        mock_sync.mget.assert_called_once()
+        mock_sync.evalsha.assert_called_once()
+        assert mock_sync.evalsha.call_args.args[1] == 3  # numkeys
 
         # close calls sync_ledger.close
         mgr._sync_ledger.close()
 
 
 def test_manager_pricing_access(config: CoreasonBudgetConfig) -> None:
-    with patch("coreason_budget.ledger.from_url"), patch("coreason_budget.ledger.sync_from_url"):
+    with patch("coreason_budget.ledger._async_client"), patch("coreason_budget.ledger.SyncRedis"):
         mgr = BudgetManager(config)
         assert mgr.pricing is not None
         # Just ensure we can call it (mocks internal)
-        with patch("coreason_budget.pricing.litellm.completion_cost", return_value=0.1):
+        with patch.object(litellm, "completion_cost", return_value=0.1):
             cost = mgr.pricing.calculate("gpt-4", 100, 100)
             assert cost == 0.1
@@ -1,9 +1,39 @@
-from unittest.mock import patch
-
+import importlib
+import re
+import sys
+import time
+from typing import Any, Dict, List
+from unittest.mock import MagicMock, patch
+
+import litellm
 import pytest
 
 from coreason_budget.config import CoreasonBudgetConfig
-from coreason_budget.pricing import PricingEngine
+from coreason_budget.pricing import LITELLM_COST_CACHE_TTL_SECONDS, PricingEngine
+
+_COST_ERROR_RE = re.compile(r"Could not calculate cost")
+
+
+@pytest.fixture(autouse=True)
+def mock_litellm(monkeypatch: pytest.MonkeyPatch) -> MagicMock:
+    # No test in this module may reach the real liteLLM pricing tables
+    mock = MagicMock(return_value=0.05)
+    monkeypatch.setattr(litellm, "completion_cost", mock)
+    return mock
+
+
+@pytest.fixture(autouse=True)
+def clock(monkeypatch: pytest.MonkeyPatch) -> MagicMock:
+    # Cached liteLLM prices expire by monotonic time; hold it still unless a test moves it
+    mock_time = MagicMock(wraps=time)
+    mock_time.monotonic.return_value = 1000.0
+    monkeypatch.setattr("coreason_budget.pricing.time", mock_time)
+    return mock_time
+
+
+@pytest.fixture(scope="module")
+def engine() -> PricingEngine:
+    return PricingEngine(CoreasonBudgetConfig(redis_url="redis://localhost"))
 
 
 def test_pricing_engine_overrides() -> None:
@@ -24,30 +54,50 @@ def test_pricing_engine_overrides() -> None:
     assert cost == pytest.approx(expected)
 
 
-def test_pricing_engine_litellm() -> None:
-    config = CoreasonBudgetConfig(redis_url="redis://localhost")
-    engine = PricingEngine(config)
+def test_pricing_engine_litellm(engine: PricingEngine, mock_litellm: MagicMock) -> None:
+    cost = engine.calculate_cost("gpt-4", 500, 200)
 
-    with patch("coreason_budget.pricing.litellm.completion_cost") as mock_cost:
-        mock_cost.return_value = 0.05
+    assert cost == 0.05
+    # A repeated usage shape is served from the engine's cache
+    assert engine.calculate_cost("gpt-4", 500, 200) == 0.05
+    mock_litellm.assert_called_once_with(
+        model="gpt-4", prompt=None, completion=None, total_input_tokens=500, total_output_tokens=200
+    )
 
-        cost = engine.calculate_cost("gpt-4", 500, 200)
 
-        assert cost == 0.05
-        mock_cost.assert_called_once_with(
-            model="gpt-4", prompt=None, completion=None, total_input_tokens=500, total_output_tokens=200
-        )
+def test_pricing_engine_litellm_cache_expires(mock_litellm: MagicMock, clock: MagicMock) -> None:
+    engine = PricingEngine(CoreasonBudgetConfig(redis_url="redis://localhost"))
+    clock.monotonic.return_value = 20 * LITELLM_COST_CACHE_TTL_SECONDS  # start of a cache window
+    assert engine.calculate("gpt-4", 10, 10) == 0.05
 
+    # liteLLM prices can change at runtime: an entry is priced again once its window has passed...
+    mock_litellm.return_value = 0.07
+    clock.monotonic.return_value += LITELLM_COST_CACHE_TTL_SECONDS - 1
+    assert engine.calculate("gpt-4", 10, 10) == 0.05
+    clock.monotonic.return_value += 1
+    assert engine.calculate("gpt-4", 10, 10) == 0.07
 
-def test_pricing_engine_litellm_failure() -> None:
-    config = CoreasonBudgetConfig(redis_url="redis://localhost")
-    engine = PricingEngine(config)
+    # ...or straight away once the cache is cleared
+    mock_litellm.return_value = 0.09
+    engine.clear_cache()
+    assert engine.calculate("gpt-4", 10, 10) == 0.09
+    assert mock_litellm.call_count == 3
+
+
+def test_pricing_engine_litellm_failure(
+    engine: PricingEngine, mock_litellm: MagicMock, log_sink: List[Dict[str, Any]]
+) -> None:
+    mock_litellm.side_effect = Exception("Model not found")
+
+    with pytest.raises(ValueError, match=_COST_ERROR_RE):
+        engine.calculate_cost("unknown-model", 10, 10)
 
-    with patch("coreason_budget.pricing.litellm.completion_cost") as mock_cost:
-        mock_cost.side_effect = Exception("Model not found")
+    assert log_sink[-1]["message"] == "Failed to calculate cost for model unknown-model: Model not found"
 
-        with pytest.raises(ValueError, match="Could not calculate cost"):
-            engine.calculate_cost("unknown-model", 10, 10)
+    # Failures are not cached: the next call asks liteLLM again
+    mock_litellm.side_effect = None
+    assert engine.calculate_cost("unknown-model", 10, 10) == 0.05
+    assert mock_litellm.call_count == 2
 
 
 def test_pricing_engine_override_partial() -> None:
@@ -58,3 +108,46 @@ def test_pricing_engine_override_partial() -> None:
     engine = PricingEngine(config)
     cost = engine.calculate_cost("half-free", 100, 100)
     assert cost == 1.0  # 100 * 0.01 + 100 * 0.0
+
+
+def test_pricing_engine_override_reassignment(mock_litellm: MagicMock) -> None:
+    config = CoreasonBudgetConfig(
+        redis_url="redis://localhost", model_price_overrides={"custom-model": {"input_cost_per_token": 0.01}}
+    )
+    engine = PricingEngine(config)
+    assert engine.calculate("custom-model", 100, 100) == 1.0
+
+    # New overrides take effect on the next call; models dropped from them fall back to liteLLM
+    config.model_price_overrides = {"other-model": {"output_cost_per_token": 0.02}}
+    assert engine.calculate("other-model", 100, 100) == 2.0
+    assert engine.calculate("custom-model", 100, 100) == 0.05
+    mock_litellm.assert_called_once()
+
+
+def test_pricing_engine_override_edited_in_place(mock_litellm: MagicMock) -> None:
+    overrides = {"custom-model": {"input_cost_per_token": 0.1}}
+    config = CoreasonBudgetConfig(redis_url="redis://localhost", model_price_overrides=overrides)
+    engine = PricingEngine(config)
+    assert engine.calculate("custom-model", 100, 0) == 10.0
+
+    # Editing the configured mapping in place is picked up just like reassigning it
+    config.model_price_overrides["custom-model"]["input_cost_per_token"] = 0.2
+    config.model_price_overrides["new-model"] = {"output_cost_per_token": 0.5}
+    assert engine.calculate("custom-model", 100, 0) == 20.0
+    assert engine.calculate("new-model", 0, 10) == 5.0
+    mock_litellm.assert_not_called()
+
+
+def test_import_does_not_load_litellm() -> None:
+    # A None entry makes any `import litellm` fail; patch.dict restores the original modules afterwards
+    with patch.dict(sys.modules, {"litellm": None}):
+        for name in [m for m in sys.modules if m.startswith("coreason_budget")]:
+            del sys.modules[name]
+
+        pricing = importlib.import_module("coreason_budget.pricing")
+        importlib.import_module("coreason_budget")
+
+        config = CoreasonBudgetConfig(
+            redis_url="redis://localhost", model_price_overrides={"custom-model": {"input_cost_per_token": 0.01}}
+        )
+        assert pricing.PricingEngine(config).calculate("custom-model", 100, 100) == 1.0
@@ -1,30 +1,13 @@
-import os
-from typing import Generator
-from unittest.mock import AsyncMock, patch
+import asyncio
+from unittest.mock import AsyncMock
 
+import fakeredis
+import httpx
 import pytest
 from coreason_identity.models import UserContext
-from fakeredis import aioredis
-from fastapi.testclient import TestClient
 from redis.exceptions import ConnectionError
 
-from coreason_budget.server import app
-
-
-# Fixture to provide a TestClient with mocked Redis
-@pytest.fixture
-def client() -> Generator[TestClient, None, None]:
-    # Create a fake redis instance
-    fake_redis = aioredis.FakeRedis(decode_responses=True)
-
-    # Patch from_url in ledger.py to return our fake redis
-    # Patch os.environ to ensure configuration is valid
-    env_patch = patch.dict(os.environ, {"COREASON_BUDGET_REDIS_URL": "redis://localhost:6379"})
-    redis_patch = patch("coreason_budget.ledger.from_url", return_value=fake_redis)
-
-    with env_patch, redis_patch:
-        with TestClient(app) as c:
-            yield c
+from coreason_budget.server import app, health_check
 
 
 @pytest.fixture
@@ -45,82 +28,130 @@ def context_spend() -> dict[str, str]:
     return {"X-User-Context": context.model_dump_json()}
 
 
-def test_health_check(client: TestClient) -> None:
-    response = client.get("/health")
+async def test_health_check(app_client: httpx.AsyncClient) -> None:
+    response = await app_client.get("/health")
     assert response.status_code == 200
     assert response.json() == {"status": "healthy", "redis": "connected"}
 
 
-def test_check_budget_allowed(client: TestClient, valid_context_header: dict[str, str]) -> None:
+async def test_check_budget_allowed(app_client: httpx.AsyncClient, valid_context_header: dict[str, str]) -> None:
     # Default limit is $10.0 per user
     # user_id in body is ignored, using context
-    response = client.post("/check", json={"estimated_cost": 1.0}, headers=valid_context_header)
+    response = await app_client.post("/check", json={"estimated_cost": 1.0}, headers=valid_context_header)
     assert response.status_code == 200
     assert response.json() == {"status": "allowed"}
 
 
-def test_check_budget_exceeded(client: TestClient, context_exceed: dict[str, str]) -> None:
-    # Spend enough to exceed limit (limit=10)
-    # First, record a spend of 11
-    client.post("/spend", json={"cost": 11.0}, headers=context_exceed)
+async def test_check_budget_exceeded(
+    app_client: httpx.AsyncClient, context_exceed: dict[str, str], fake_server: fakeredis.FakeServer
+) -> None:
+    # Seed the user's usage past the limit (limit=10) straight into Redis
+    user_key = app.state.budget.guard._get_keys("user_exceed")["user"]
+    fakeredis.FakeRedis(server=fake_server).set(user_key, 11.0)
 
     # Now check
-    response = client.post("/check", json={"estimated_cost": 1.0}, headers=context_exceed)
+    response = await app_client.post("/check", json={"estimated_cost": 1.0}, headers=context_exceed)
     assert response.status_code == 429
     assert "exceeded" in response.json()["detail"].lower()
 
 
-def test_record_spend(client: TestClient, context_spend: dict[str, str]) -> None:
-    response = client.post("/spend", json={"cost": 5.0}, headers=context_spend)
+async def test_record_spend(app_client: httpx.AsyncClient, context_spend: dict[str, str]) -> None:
+    response = await app_client.post("/spend", json={"cost": 5.0}, headers=context_spend)
     assert response.status_code == 200
     assert response.json() == {"status": "recorded"}
 
     # Verify usage increased
     # user_spend has 5.0 used. Limit is 10.0.
     # Try check 6.0 -> 5+6=11 > 10 -> fail
-    response = client.post("/check", json={"estimated_cost": 6.0}, headers=context_spend)
+    response = await app_client.post("/check", json={"estimated_cost": 6.0}, headers=context_spend)
+    assert response.status_code == 429
+
+
+async def test_record_spend_background(app_client: httpx.AsyncClient, context_spend: dict[str, str]) -> None:
+    response = await app_client.post("/spend", params={"background": "true"}, json={"cost": 5.0}, headers=context_spend)
+    assert response.status_code == 200
+    assert response.json() == {"status": "queued"}
+
+    # Once the queue is flushed the spend counts against the limit
+    await app.state.budget.flush()
+    response = await app_client.post("/check", json={"estimated_cost": 6.0}, headers=context_spend)
     assert response.status_code == 429
 
 
-def test_missing_context(client: TestClient) -> None:
-    response = client.post("/check", json={"estimated_cost": 1.0})
+async def test_missing_context(app_client: httpx.AsyncClient) -> None:
+    response = await app_client.post("/check", json={"estimated_cost": 1.0})
     assert response.status_code == 401
     assert "Missing User Context" in response.json()["detail"]
 
 
-def test_invalid_context(client: TestClient) -> None:
-    response = client.post("/check", json={"estimated_cost": 1.0}, headers={"X-User-Context": "invalid-json"})
+async def test_invalid_context(app_client: httpx.AsyncClient) -> None:
+    response = await app_client.post("/check", json={"estimated_cost": 1.0}, headers={"X-User-Context": "invalid-json"})
     assert response.status_code == 401
     assert "Invalid User Context" in response.json()["detail"]
 
 
-def test_validation_error_logic(client: TestClient) -> None:
+async def test_validation_error_logic(app_client: httpx.AsyncClient) -> None:
     # Empty user_id in context -> 400 Bad Request (BudgetManager validation)
     context = UserContext(user_id="", email="user@example.com", groups=[], scopes=[], claims={})
     headers = {"X-User-Context": context.model_dump_json()}
 
-    response = client.post("/check", json={"estimated_cost": 1.0}, headers=headers)
+    response = await app_client.post("/check", json={"estimated_cost": 1.0}, headers=headers)
     assert response.status_code == 400
     assert "user_id" in response.json()["detail"]
 
 
-def test_record_spend_validation_error(client: TestClient, valid_context_header: dict[str, str]) -> None:
-    # Use empty project_id to trigger ValueError in validate_record_spend_inputs
-    response = client.post("/spend", json={"cost": 5.0, "project_id": "  "}, headers=valid_context_header)
+@pytest.mark.parametrize(
+    "payload,field",
+    [
+        ({"project_id": ""}, "project_id"),
+        ({"project_id": "  "}, "project_id"),
+        ({"model": ""}, "model"),
+        ({"model": "\t"}, "model"),
+    ],
+)
+async def test_record_spend_validation_error(
+    app_client: httpx.AsyncClient, valid_context_header: dict[str, str], payload: dict[str, str], field: str
+) -> None:
+    # Blank project_id/model trigger ValueError in validate_record_spend_inputs
+    response = await app_client.post("/spend", json={"cost": 5.0, **payload}, headers=valid_context_header)
     assert response.status_code == 400
-    assert "project_id" in response.json()["detail"]
+    assert response.json()["detail"].startswith(f"{field} must be a non-empty string")
 
 
-def test_health_check_failure(client: TestClient) -> None:
+async def test_health_check_failure(app_client: httpx.AsyncClient, monkeypatch: pytest.MonkeyPatch) -> None:
     budget = app.state.budget
-    original_ping = budget._async_ledger._redis.ping
 
-    # Use AsyncMock to ensure it's awaited correctly and raises
-    budget._async_ledger._redis.ping = AsyncMock(side_effect=ConnectionError("Simulated failure"))
+    # Use AsyncMock to ensure it's awaited correctly and raises; monkeypatch restores ping
+    monkeypatch.setattr(
+        budget._async_ledger._redis, "ping", AsyncMock(side_effect=ConnectionError("Simulated failure"))
+    )
+
+    response = await app_client.get("/health")
+    assert response.status_code == 503
+    assert "Redis connection failed" in response.json()["detail"]
+
+
+async def test_health_check_cached(app_client: httpx.AsyncClient, monkeypatch: pytest.MonkeyPatch) -> None:
+    mock_ping = AsyncMock(return_value=True)
+    monkeypatch.setattr(app.state.budget._async_ledger._redis, "ping", mock_ping)
+
+    for _ in range(10):
+        assert (await app_client.get("/health")).status_code == 200
+    mock_ping.assert_awaited_once()
+
+    # Once the cached result is stale the next probe pings again
+    monkeypatch.setattr("coreason_budget.server.HEALTH_CACHE_TTL_SECONDS", 0.0)
+    assert (await app_client.get("/health")).status_code == 200
+    assert mock_ping.await_count == 2
+
+
+async def test_health_check_single_flight(app_client: httpx.AsyncClient, monkeypatch: pytest.MonkeyPatch) -> None:
+    mock_ping = AsyncMock(return_value=True)
+    monkeypatch.setattr(app.state.budget._async_ledger._redis, "ping", mock_ping)
+
+    # Every probe starts on a cold cache before the ping runs, so they can only share it
+    results = await asyncio.gather(*[health_check() for _ in range(5)])
 
-    try:
-        response = client.get("/health")
-        assert response.status_code == 503
-        assert "Redis connection failed" in response.json()["detail"]
-    finally:
-        budget._async_ledger._redis.ping = original_ping
+    assert results == [{"status": "healthy", "redis": "connected"}] * 5
+    mock_ping.assert_awaited_once()
+    assert app.state.ping_task is None
@@ -0,0 +1,104 @@
+import asyncio
+from typing import Any, Dict, List
+
+import fakeredis
+import pytest
+from coreason_identity.models import UserContext
+from redis.exceptions import ResponseError
+
+from coreason_budget.guard import Spend
+from coreason_budget.manager import BudgetManager
+from coreason_budget.spend_queue import SpendQueue
+
+
+def create_context(user_id: str) -> UserContext:
+    return UserContext(user_id=user_id, email="test@example.com", groups=[], scopes=[], claims={})
+
+
+async def test_background_spends_share_one_write(manager: BudgetManager, monkeypatch: pytest.MonkeyPatch) -> None:
+    calls: List[int] = []
+    charge_many = manager.guard.charge_many
+
+    async def spy(spends: List[Spend]) -> None:
+        calls.append(len(spends))
+        await charge_many(spends)
+
+    monkeypatch.setattr(manager.guard, "charge_many", spy)
+    alice, bob = create_context("queue_alice"), create_context("queue_bob")
+
+    for _ in range(3):
+        manager.record_spend_background(alice, 1.0, "queue_proj")
+    manager.record_spend_background(bob, 2.0)
+    await manager.flush()
+
+    # Nothing yielded between the puts, so the worker drained all four at once
+    assert calls == [4]
+    ledger = manager._async_ledger
+    keys = manager.guard._get_keys("queue_alice", "queue_proj")
+    assert await ledger.get_usage_many(list(keys.values())) == [5.0, 3.0, 3.0]
+    assert await ledger.get_usage(manager.guard._get_keys("queue_bob")["user"]) == 2.0
+
+
+async def test_spend_queue_max_batch(manager: BudgetManager, monkeypatch: pytest.MonkeyPatch) -> None:
+    calls: List[int] = []
+
+    async def record(spends: List[Spend]) -> None:
+        calls.append(len(spends))
+
+    monkeypatch.setattr(manager.guard, "charge_many", record)
+    queue = SpendQueue(manager.guard, max_batch=2)
+
+    for _ in range(5):
+        queue.put(Spend(create_context("batch_user"), 1.0))
+    await queue.flush()
+
+    assert calls == [2, 2, 1]
+
+
+async def test_spend_queue_logs_failed_writes(
+    manager: BudgetManager, fake_server: fakeredis.FakeServer, log_sink: List[Dict[str, Any]]
+) -> None:
+    context = create_context("queue_failure")
+    user_key = manager.guard._get_keys("queue_failure")["user"]
+
+    fake_server.connected = False
+    manager.record_spend_background(context, 1.0)
+    await manager.flush()
+
+    assert any(r["message"].startswith("Failed to record 1 queued spends") for r in log_sink)
+
+    # The queue keeps working once Redis is back
+    fake_server.connected = True
+    manager.record_spend_background(context, 1.0)
+    await manager.flush()
+    assert await manager._async_ledger.get_usage(user_key) == 1.0
+
+
+async def test_rejected_spend_only_fails_itself(
+    manager: BudgetManager, fake_redis: fakeredis.FakeAsyncRedis, log_sink: List[Dict[str, Any]]
+) -> None:
+    alice, bob = create_context("reject_alice"), create_context("reject_bob")
+    await fake_redis.set(manager.guard._get_keys("reject_bob")["user"], "junk")
+
+    for context in (alice, bob, bob, alice):
+        manager.record_spend_background(context, 1.0)
+    await manager.flush()
+
+    # Bob's corrupt key fails only Bob's spends; Alice's are written around it
+    assert await manager._async_ledger.get_usage(manager.guard._get_keys("reject_alice")["user"]) == 2.0
+    assert any(r["message"].startswith("Failed to record 2 queued spends") for r in log_sink)
+
+
+async def test_record_spend_writes_each_call_on_its_own(
+    manager: BudgetManager, fake_redis: fakeredis.FakeAsyncRedis
+) -> None:
+    alice, bob = create_context("direct_alice"), create_context("direct_bob")
+    await fake_redis.set(manager.guard._get_keys("direct_bob")["user"], "junk")
+
+    results = await asyncio.gather(
+        manager.record_spend(alice, 1.0), manager.record_spend(bob, 1.0), return_exceptions=True
+    )
+
+    assert results[0] is None
+    assert isinstance(results[1], ResponseError)
+    assert await manager._async_ledger.get_usage(manager.guard._get_keys("direct_alice")["user"]) == 1.0
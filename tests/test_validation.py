@@ -1,33 +1,48 @@
+import re
+from typing import Any, Dict
+
 import pytest
 
 from coreason_budget.validation import validate_check_availability_inputs, validate_record_spend_inputs
 
+_USER_ID_RE = re.compile(r"user_id must be a non-empty string")
+_PROJECT_ID_RE = re.compile(r"project_id must be a non-empty string")
+_MODEL_RE = re.compile(r"model must be a non-empty string")
+_AMOUNT_RE = re.compile(r"Amount must be a finite number")
+
 
 def test_validate_check_availability_inputs() -> None:
     validate_check_availability_inputs("user1")
 
-    with pytest.raises(ValueError, match="user_id must be a non-empty string"):
-        validate_check_availability_inputs("")
 
-    with pytest.raises(ValueError, match="user_id must be a non-empty string"):
-        validate_check_availability_inputs(None)  # type: ignore
+@pytest.mark.parametrize("user_id", ["", "   ", None])
+def test_validate_check_availability_inputs_rejects_user_id(user_id: Any) -> None:
+    with pytest.raises(ValueError, match=_USER_ID_RE):
+        validate_check_availability_inputs(user_id)
 
 
 def test_validate_record_spend_inputs() -> None:
     validate_record_spend_inputs("user1", 10.0)
     validate_record_spend_inputs("user1", 10.0, "proj1", "model1")
 
-    with pytest.raises(ValueError, match="user_id must be a non-empty string"):
-        validate_record_spend_inputs("", 10.0)
-
-    with pytest.raises(ValueError, match="Amount must be a finite number"):
-        validate_record_spend_inputs("user1", float("inf"))
-
-    with pytest.raises(ValueError, match="Amount must be a finite number"):
-        validate_record_spend_inputs("user1", float("nan"))
-
-    with pytest.raises(ValueError, match="project_id must be a non-empty string"):
-        validate_record_spend_inputs("user1", 10.0, "")
 
-    with pytest.raises(ValueError, match="model must be a non-empty string"):
-        validate_record_spend_inputs("user1", 10.0, "proj1", "")
+@pytest.mark.parametrize(
+    "kwargs,match",
+    [
+        ({"user_id": "", "amount": 10.0}, _USER_ID_RE),
+        ({"user_id": " \t", "amount": 10.0}, _USER_ID_RE),
+        ({"user_id": "user1", "amount": 10.0, "project_id": ""}, _PROJECT_ID_RE),
+        ({"user_id": "user1", "amount": 10.0, "project_id": "  "}, _PROJECT_ID_RE),
+        ({"user_id": "user1", "amount": 10.0, "project_id": "proj1", "model": ""}, _MODEL_RE),
+        ({"user_id": "user1", "amount": 10.0, "project_id": "proj1", "model": "\n"}, _MODEL_RE),
+    ],
+)
+def test_validate_record_spend_inputs_rejects_empty_strings(kwargs: Dict[str, Any], match: re.Pattern[str]) -> None:
+    with pytest.raises(ValueError, match=match):
+        validate_record_spend_inputs(**kwargs)
+
+
+@pytest.mark.parametrize("amount", [float("nan"), float("inf"), -float("inf")])
+def test_validate_record_spend_inputs_rejects_non_finite_amount(amount: float) -> None:
+    with pytest.raises(ValueError, match=_AMOUNT_RE):
+        validate_record_spend_inputs("user1", amount)